@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+from serial.tools import list_ports
+
+from flasher_core import DEFAULT_BAUD, connect, data_path
+
+BAUD_LADDER = [115200, 230400, 460800, 921600, 1500000, 2000000]
+SAMPLE_SIZE = 64 * 1024  # Bytes read back from the bootloader region per trial
+TRIALS = 3
+MAX_ERROR_RATE = 0.0
+PROFILE_FILE = "baud_profiles.json"
+
+
+def adapter_key(port):
+    # USB adapters are identified by VID/PID/serial so the profile follows the
+    # adapter to whatever COM/tty name it gets next time
+    for info in list_ports.comports():
+        if info.device == port and info.vid is not None:
+            return f"{info.vid:04X}:{info.pid:04X}:{info.serial_number or ''}"
+    return port
+
+
+class RateResult:
+    def __init__(self, baud):
+        self.baud = baud
+        self.trials = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def error_rate(self):
+        return self.errors / self.trials if self.trials else 1.0
+
+    @property
+    def stable(self):
+        return self.trials > 0 and self.error_rate <= MAX_ERROR_RATE
+
+    def to_dict(self):
+        return {
+            "baud": self.baud,
+            "trials": self.trials,
+            "errors": self.errors,
+            "bytes_per_second": round(self.bytes_per_second),
+            "error": self.error,
+        }
+
+
+class BaudProfiles:
+    def __init__(self, path=None):
+        self.path = path or data_path(PROFILE_FILE)
+        self._lock = threading.Lock()
+        self.profiles = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.profiles = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable baud profiles {self.path}: {e}")
+
+    def get(self, port):
+        profile = self.profiles.get(adapter_key(port))
+        return profile["baud"] if profile else None
+
+    def set(self, port, baud, bytes_per_second):
+        with self._lock:
+            self.profiles[adapter_key(port)] = {
+                "baud": baud,
+                "bytes_per_second": round(bytes_per_second),
+                "port": port,
+                "calibrated_at": time.time(),
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.profiles, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+
+_profiles = None
+
+
+def baud_profiles():
+    global _profiles
+    if _profiles is None:
+        _profiles = BaudProfiles()
+    return _profiles
+
+
+def baud_for_port(port, default=DEFAULT_BAUD):
+    return baud_profiles().get(port) or default
+
+
+def measure_rate(port, baud, trials=TRIALS, sample_size=SAMPLE_SIZE):
+    # Each rate gets a fresh connection, so a failed rate cannot leave the
+    # stub stuck at a speed the adapter can't do
+    import esptool
+    result = RateResult(baud)
+    try:
+        esp = connect(port, baud)
+    except (esptool.FatalError, OSError) as e:
+        result.trials = 1
+        result.errors = 1
+        result.error = str(e)
+        return result
+    try:
+        for _ in range(trials):
+            result.trials += 1
+            t = time.time()
+            try:
+                # The stub checks the MD5 of the data it sends, so corruption
+                # on the wire shows up as an error here
+                esp.read_flash(0, sample_size)
+            except (esptool.FatalError, OSError, StopIteration) as e:
+                result.errors += 1
+                result.error = str(e)
+                break
+            result.seconds += time.time() - t
+            result.bytes += sample_size
+    finally:
+        esp._port.close()
+    return result
+
+
+def best_result(results):
+    stable = [result for result in results if result.stable]
+    return max(stable, key=lambda result: result.bytes_per_second) if stable else None
+
+
+def calibrate(port, ladder=BAUD_LADDER, trials=TRIALS, profiles=None):
+    results = []
+    for baud in ladder:
+        print(f"Calibrating {port} at {baud} baud...")
+        result = measure_rate(port, baud, trials)
+        results.append(result)
+        if not result.stable:
+            # Faster rates only get worse once a rate starts failing
+            break
+    best = best_result(results)
+    if best:
+        (profiles or baud_profiles()).set(port, best.baud, best.bytes_per_second)
+    return results
+
+
+def format_report(port, results):
+    lines = [f"Baud calibration for {port} ({adapter_key(port)})",
+             f"{'baud':>9}  {'bytes/s':>9}  {'kbit/s':>8}  {'errors':>7}"]
+    for result in results:
+        lines.append(f"{result.baud:>9}  {result.bytes_per_second:>9.0f}  "
+                     f"{result.bytes_per_second * 8 / 1000:>8.1f}  "
+                     f"{result.errors:>3}/{result.trials:<3}")
+    best = best_result(results)
+    if best:
+        lines.append(f"Best stable rate: {best.baud} baud "
+                     f"({best.bytes_per_second / 1024:.1f} KiB/s effective)")
+    else:
+        lines.append("No stable rate found")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the fastest stable baud rate per serial adapter")
+    parser.add_argument("ports", nargs="+", help="Serial ports or pyserial URLs to calibrate")
+    parser.add_argument("--trials", type=int, default=TRIALS)
+    parser.add_argument("--ladder", type=lambda value: [int(baud) for baud in value.split(",")],
+                        default=BAUD_LADDER, help="Comma separated baud rates to try, lowest first")
+    args = parser.parse_args()
+    for port in args.ports:
+        print(format_report(port, calibrate(port, args.ladder, args.trials)))
@@ -0,0 +1,37 @@
+import contextlib
+import json
+import statistics
+import sys
+import time
+
+# What the benchmark scripts share: timing summaries, the --record/--label
+# history file and keeping stdout for the results.
+
+
+def summarize(timings, unit="s"):
+    # Milliseconds get one decimal, seconds three
+    digits = 1 if unit == "ms" else 3
+    return {f"median_{unit}": round(statistics.median(timings), digits),
+            f"min_{unit}": round(min(timings), digits),
+            f"max_{unit}": round(max(timings), digits)}
+
+
+def add_record_arguments(parser):
+    parser.add_argument("--record", help="Append the JSON result to this file")
+    parser.add_argument("--label", default="", help="Release or commit the result belongs to")
+
+
+def new_result(args, **fields):
+    return dict({"label": args.label, "recorded_at": time.time(),
+                 "python": sys.version.split()[0]}, **fields)
+
+
+def record(args, result):
+    if args.record:
+        with open(args.record, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+def results_only_on_stdout():
+    # Keep stdout for the results; esptool chatter goes to stderr
+    return contextlib.redirect_stdout(sys.stderr)
@@ -0,0 +1,116 @@
+import argparse
+import os
+import subprocess
+import sys
+
+from bench_common import add_record_arguments, new_result, record, summarize
+
+# Cold-start benchmark for the GUI: time to import main.py (and optionally
+# to the first drawn window) in fresh interpreters, plus an import-time
+# profile of the slowest modules. Append the JSON result to a history file
+# with --record to track startup across releases.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Startup budget, milliseconds
+IMPORT_BUDGET_MS = 250
+WINDOW_BUDGET_MS = 1000
+
+# Modules that must not load before the first flash
+LAZY_MODULES = ['esptool', 'pyperclip']
+
+IMPORT_SCRIPT = """
+import sys, time
+t = time.perf_counter()
+import main
+print(time.perf_counter() - t)
+print(','.join(m for m in %r if m in sys.modules))
+""" % (LAZY_MODULES,)
+
+WINDOW_SCRIPT = """
+import time
+t = time.perf_counter()
+import main
+root = main.tb.Window(themename="cosmo")
+app = main.ESP32Flasher(root)
+root.update()
+print(time.perf_counter() - t)
+app.orchestrator.stop()
+app.telemetry.sink.close()
+app.serial_logs.close()
+app.history.close()
+root.destroy()
+"""
+
+
+def run_python(script, *options):
+    result = subprocess.run([sys.executable, *options, "-c", script], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True)
+    return result.stdout.splitlines(), result.stderr
+
+
+def time_imports(runs):
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        lines, _ = run_python(IMPORT_SCRIPT)
+        timings.append(float(lines[0]) * 1000)
+        loaded.update(module for module in lines[1].split(",") if module)
+    return timings, sorted(loaded)
+
+
+def time_window(runs):
+    return [float(run_python(WINDOW_SCRIPT)[0][0]) * 1000 for _ in range(runs)]
+
+
+def import_profile(top=15):
+    # -X importtime lines: "import time: self [us] | cumulative | name"
+    _, stderr = run_python("import main", "-X", "importtime")
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({"module": name.strip(), "self_ms": int(self_us) / 1000,
+                        "cumulative_ms": int(cumulative_us) / 1000})
+    return sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the flasher's cold start")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--window", action="store_true",
+                        help="Also time the first drawn window (needs a display)")
+    add_record_arguments(parser)
+    args = parser.parse_args()
+
+    timings, loaded = time_imports(args.runs)
+    result = new_result(args, **{"import": summarize(timings, "ms"), "eagerly_loaded": loaded})
+    if args.window:
+        result["window"] = summarize(time_window(args.runs), "ms")
+
+    print(f"import main: {result['import']['median_ms']} ms median "
+          f"(budget {IMPORT_BUDGET_MS} ms, {args.runs} runs)")
+    if "window" in result:
+        print(f"first window: {result['window']['median_ms']} ms median (budget {WINDOW_BUDGET_MS} ms)")
+    print(f"{'self ms':>8}  {'cum ms':>8}  module")
+    for module in import_profile():
+        print(f"{module['self_ms']:>8.1f}  {module['cumulative_ms']:>8.1f}  {module['module']}")
+
+    failures = []
+    if result["import"]["median_ms"] > IMPORT_BUDGET_MS:
+        failures.append("import time over budget")
+    if "window" in result and result["window"]["median_ms"] > WINDOW_BUDGET_MS:
+        failures.append("first window over budget")
+    if loaded:
+        failures.append(f"loaded at startup: {', '.join(loaded)}")
+    result["failures"] = failures
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    record(args, result)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# In-process esptool against the esptool command line in a child process,
+# the way the flasher used to run the bundled esptool.exe on Windows: same
+# package, same simulated board (sim_device), same baud rate. Reports the
+# time per board, the time to the first progress update and how many
+# progress updates each path delivers. Point --esptool at an esptool.exe to
+# measure the executable itself instead of "python -m esptool".
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from device_session import flash_device
+from firmware import load_package
+from flasher_core import reset_mode
+from sim_device import SimulatedESP32, write_package
+
+from bench_common import add_record_arguments, new_result, record, results_only_on_stdout, summarize
+
+MAC_PATTERN = re.compile(r'MAC:\s+([0-9A-Fa-f:]{17})')
+WRITING_PATTERN = re.compile(r'Writing at (0x[0-9A-Fa-f]+)\.\.\. \((\d+) %\)')
+
+
+def flash_in_process(port, package, baud, verify):
+    started = time.perf_counter()
+    first = []
+    updates = []
+
+    def on_progress(progress):
+        if not first:
+            first.append(time.perf_counter() - started)
+        updates.append(progress.written)
+
+    mac = flash_device(port, package, baud, on_progress=on_progress,
+                       on_verify=(lambda results: None) if verify else None)
+    return time.perf_counter() - started, first[0] if first else None, len(updates), mac
+
+
+def flash_command(port, package, files, baud, verify):
+    cmd = ['--chip', package.chip, '--port', port, '--baud', str(baud),
+           '--before', reset_mode(port), '--after', 'hard_reset',
+           'write_flash', '-z', '--flash_mode', package.flash_mode,
+           '--flash_freq', package.flash_freq, '--flash_size', package.flash_size]
+    if verify:
+        cmd.append('--verify')
+    for offset, path in files:
+        cmd.extend([hex(offset), path])
+    return cmd
+
+
+def flash_subprocess(port, package, baud, verify, esptool):
+    # Everything the old path did per board: write the images out, start
+    # esptool and scrape its output for progress and the MAC
+    started = time.perf_counter()
+    first = None
+    updates = 0
+    mac = None
+    with tempfile.TemporaryDirectory(prefix="esp32flasher-") as directory:
+        cmd = esptool + flash_command(port, package, package.write_files(directory), baud, verify)
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        for line in process.stdout:
+            if WRITING_PATTERN.search(line):
+                if first is None:
+                    first = time.perf_counter() - started
+                updates += 1
+            match = MAC_PATTERN.search(line)
+            if match:
+                mac = match.group(1)
+        process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"esptool returned non-zero exit code: {process.returncode}")
+    return time.perf_counter() - started, first, updates, mac
+
+
+def bench(flash, runs, wire_speed):
+    timings = []
+    first_progress = []
+    updates = []
+    for index in range(runs):
+        mac = f"24:6f:28:00:02:{index:02x}"
+        with SimulatedESP32(mac=mac, wire_speed=wire_speed) as sim:
+            elapsed, first, count, seen_mac = flash(sim.url)
+        if seen_mac != mac:
+            raise RuntimeError(f"Expected MAC {mac}, got {seen_mac}")
+        timings.append(elapsed)
+        if first is not None:
+            first_progress.append(first)
+        updates.append(count)
+    return {"per_board": summarize(timings),
+            "first_progress": summarize(first_progress) if first_progress else None,
+            "progress_updates": round(statistics.median(updates))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark in-process esptool against a subprocess")
+    parser.add_argument("--package", help="Firmware package, default a generated 1 MB app")
+    parser.add_argument("--app-size", type=int, default=1024 * 1024,
+                        help="Size of the generated app image in bytes")
+    parser.add_argument("--esptool", help="esptool executable, default this Python's esptool module")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--verify", action="store_true", help="Verify the written images")
+    parser.add_argument("--no-wire-speed", action="store_true",
+                        help="Do not model UART transfer time")
+    parser.add_argument("--runs", type=int, default=5)
+    add_record_arguments(parser)
+    args = parser.parse_args()
+    esptool = [args.esptool] if args.esptool else [sys.executable, "-m", "esptool"]
+    wire_speed = not args.no_wire_speed
+
+    with tempfile.TemporaryDirectory() as tmp, results_only_on_stdout():
+        path = args.package or write_package(os.path.join(tmp, "bench.zip"), args.app_size)
+        package = load_package(path).prefetch()
+        in_process = bench(lambda port: flash_in_process(port, package, args.baud, args.verify),
+                           args.runs, wire_speed)
+        child = bench(lambda port: flash_subprocess(port, package, args.baud, args.verify, esptool),
+                      args.runs, wire_speed)
+    result = new_result(args, platform=sys.platform, baud=args.baud, verify=args.verify,
+                        wire_speed=wire_speed, in_process=in_process, subprocess=child)
+
+    for name, stats in (("in-process", in_process), ("subprocess", child)):
+        first = stats["first_progress"]
+        print(f"{name}: {stats['per_board']['median_s']} s per board median, first progress after "
+              f"{first['median_s'] if first else '-'} s, {stats['progress_updates']} progress updates")
+    saved = child["per_board"]["median_s"] - in_process["per_board"]["median_s"]
+    print(f"in-process saves {saved:.3f} s per board ({args.runs} runs)")
+
+    record(args, result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Hardware-free throughput benchmark: flashes simulated boards (sim_device)
+# through the same FlashEngine the CLI uses and reads a long boot log through
+# the SerialMonitor. Wire speed is modelled by default, so flash times are in
+# the range of real boards; --no-wire-speed leaves only the flasher's own
+# overhead. Append the JSON result to a history file with --record.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from flash_engine import SUCCESS, FlashEngine
+from serial_monitor import SerialMonitor
+from sim_device import DEFAULT_BOOT_LOG, SimulatedESP32, write_package
+from telemetry import Telemetry, format_summary
+
+from bench_common import add_record_arguments, new_result, record, results_only_on_stdout, summarize
+
+MONITOR_TIMEOUT = 60.0
+
+
+def bench_flash(package, devices, baud, wire_speed, diff, runs):
+    timings = []
+    rates = []
+    telemetry = Telemetry()
+    for _ in range(runs):
+        sims = [SimulatedESP32(mac=f"24:6f:28:00:01:{index:02x}", wire_speed=wire_speed).start()
+                for index in range(devices)]
+        try:
+            if diff:
+                # Boards that already run this firmware
+                FlashEngine(package, [sim.url for sim in sims], max_workers=devices,
+                            baud=baud).run()
+            engine = FlashEngine(package, [sim.url for sim in sims], max_workers=devices,
+                                 baud=baud, diff=diff, telemetry=telemetry)
+            results = engine.run()
+        finally:
+            for sim in sims:
+                sim.stop()
+        failed = [result.port for result in results if result.state != SUCCESS]
+        if failed:
+            raise RuntimeError(f"Flashing failed on {', '.join(failed)}")
+        timings.extend(result.duration for result in results)
+        rates.append(engine.boards_per_hour())
+    return {"per_board": summarize(timings),
+            "boards_per_hour": round(statistics.median(rates)),
+            "phases": telemetry.summary().get(None, {})}
+
+
+def bench_monitor(lines, baud, runs):
+    repeat = max(0, lines // len(DEFAULT_BOOT_LOG) - 1)
+    expected = len(DEFAULT_BOOT_LOG) * (repeat + 1)
+    timings = []
+    received = 0
+    for _ in range(runs):
+        with SimulatedESP32(boot_log_repeat=repeat) as sim:
+            sim.reset()
+            started = time.perf_counter()
+            monitor = SerialMonitor(sim.url, baud).start()
+            deadline = time.time() + MONITOR_TIMEOUT
+            while monitor.lines_received < expected and time.time() < deadline:
+                monitor.drain()
+                time.sleep(0.01)
+            timings.append(time.perf_counter() - started)
+            monitor.stop()
+            received = monitor.bytes_received
+            if monitor.lines_received < expected:
+                raise RuntimeError(f"Monitor got {monitor.lines_received} of {expected} lines")
+    median = statistics.median(timings)
+    return {"lines": expected, "bytes": received, "elapsed": summarize(timings),
+            "lines_per_s": round(expected / median),
+            "mb_per_s": round(received / median / 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark flashing and monitoring simulated boards")
+    parser.add_argument("--package", help="Firmware package, default a generated 1 MB app")
+    parser.add_argument("--app-size", type=int, default=1024 * 1024,
+                        help="Size of the generated app image in bytes")
+    parser.add_argument("--devices", type=int, default=4, help="Boards flashed in parallel")
+    parser.add_argument("--baud", type=int, default=921600)
+    parser.add_argument("--no-wire-speed", action="store_true",
+                        help="Do not model UART transfer time")
+    parser.add_argument("--diff", action="store_true",
+                        help="Re-flash boards that already have the package")
+    parser.add_argument("--monitor-lines", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=3)
+    add_record_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, results_only_on_stdout():
+        package = args.package or write_package(os.path.join(tmp, "bench.zip"), args.app_size)
+        flash = bench_flash(package, args.devices, args.baud, not args.no_wire_speed, args.diff,
+                            args.runs)
+        monitor = bench_monitor(args.monitor_lines, args.baud, args.runs)
+    result = new_result(args, devices=args.devices, baud=args.baud,
+                        wire_speed=not args.no_wire_speed, diff=args.diff, flash=flash,
+                        monitor=monitor)
+
+    print(f"flash: {flash['per_board']['median_s']} s per board median, "
+          f"{flash['boards_per_hour']} boards/hour ({args.devices} boards, {args.runs} runs)")
+    print(format_summary({None: flash["phases"]}))
+    print(f"monitor: {monitor['lines']} lines in {monitor['elapsed']['median_s']} s median, "
+          f"{monitor['lines_per_s']} lines/s, {monitor['mb_per_s']} MB/s")
+
+    record(args, result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
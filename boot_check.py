@@ -0,0 +1,143 @@
+import json
+import re
+import time
+
+# Pass/fail verdict on what a freshly flashed board prints. A board passes
+# once every expected marker has shown up and fails on the first forbidden
+# one; the verdict is final as soon as it is known, so the board can be
+# released without waiting out the timeout. Rules can be kept in a file:
+#
+#   {"expected": ["Setup done", "WiFi connected"],
+#    "forbidden": ["Guru Meditation", "rst:0x10"], "timeout": 15, "regex": false}
+#
+# Markers are plain substrings unless "regex" is set.
+
+PASS = "pass"
+FAIL = "fail"
+
+DEFAULT_FORBIDDEN = [
+    "Guru Meditation",
+    "Backtrace:",
+    "abort() was called",
+    "CORRUPT HEAP",
+    "Brownout detector was triggered",
+    "Task watchdog got triggered",
+    "rst:0x10",  # RTC watchdog reset
+    "invalid header",  # ROM cannot boot the bootloader
+]
+DEFAULT_TIMEOUT = 10.0  # Seconds after the reset
+
+
+class BootRules:
+    def __init__(self, expected=(), forbidden=DEFAULT_FORBIDDEN, timeout=DEFAULT_TIMEOUT,
+                 regex=False):
+        self.expected = list(expected)
+        self.forbidden = list(forbidden)
+        self.timeout = timeout
+        self.regex = regex
+        try:
+            self._expected = [self._compile(marker) for marker in self.expected]
+            self._forbidden = [self._compile(marker) for marker in self.forbidden]
+            # One pass over each line finds out whether any marker is in it;
+            # only lines that hit are looked at marker by marker
+            self._any_expected = self._combine(self.expected)
+            self._any_forbidden = self._combine(self.forbidden)
+        except re.error as e:
+            raise ValueError(f"Invalid boot check pattern: {e}")
+
+    def _compile(self, marker):
+        return re.compile(marker if self.regex else re.escape(marker))
+
+    def _combine(self, markers):
+        if not markers:
+            return None
+        return re.compile("|".join(f"(?:{marker})" if self.regex else re.escape(marker)
+                                   for marker in markers))
+
+    def forbidden_in(self, line):
+        # The first forbidden marker in a line, or None
+        if self._any_forbidden is None or not self._any_forbidden.search(line):
+            return None
+        return next(marker for marker, pattern in zip(self.forbidden, self._forbidden)
+                    if pattern.search(line))
+
+    def expected_in(self, line, indexes):
+        # Which of the expected markers `indexes` are in a line
+        if self._any_expected is None or not self._any_expected.search(line):
+            return set()
+        return {i for i in indexes if self._expected[i].search(line)}
+
+    @classmethod
+    def from_dict(cls, rules):
+        unknown = set(rules) - {"expected", "forbidden", "timeout", "regex"}
+        if unknown:
+            raise ValueError(f"Unknown boot check settings: {', '.join(sorted(unknown))}")
+        return cls(rules.get("expected", ()), rules.get("forbidden", DEFAULT_FORBIDDEN),
+                   rules.get("timeout", DEFAULT_TIMEOUT), rules.get("regex", False))
+
+    def to_dict(self):
+        return {"expected": self.expected, "forbidden": self.forbidden,
+                "timeout": self.timeout, "regex": self.regex}
+
+    def check(self, started_at=None):
+        return BootCheck(self, started_at)
+
+
+class BootCheck:
+    # The verdict for one boot. Feed it every line the board prints.
+    def __init__(self, rules, started_at=None):
+        self.rules = rules
+        self.started_at = started_at or time.time()
+        self.verdict = None
+        self.reason = None
+        self.line = None  # The line that decided it
+        self.decided_at = None
+        self.missing = set(range(len(rules.expected)))
+
+    @property
+    def done(self):
+        return self.verdict is not None
+
+    def feed(self, lines):
+        # Returns the verdict, None while there is none yet
+        for line in lines:
+            if self.verdict is not None:
+                break
+            marker = self.rules.forbidden_in(line)
+            if marker is not None:
+                self._decide(FAIL, f"'{marker}' in the boot output", line)
+            elif self.missing:
+                self.missing -= self.rules.expected_in(line, self.missing)
+                if not self.missing:
+                    self._decide(PASS, "All expected output seen", line)
+        return self.verdict
+
+    def expire(self, now=None):
+        # Decide once the timeout has run out; returns the verdict
+        now = now or time.time()
+        if self.verdict is None and now - self.started_at >= self.rules.timeout:
+            if self.missing:
+                missing = ", ".join(f"'{self.rules.expected[i]}'" for i in sorted(self.missing))
+                self._decide(FAIL, f"Timed out waiting for {missing}", None, now)
+            else:
+                self._decide(PASS, f"No forbidden output within {self.rules.timeout:g} s", None, now)
+        return self.verdict
+
+    def _decide(self, verdict, reason, line, now=None):
+        self.verdict = verdict
+        self.reason = reason
+        self.line = line
+        self.decided_at = now or time.time()
+
+    def to_dict(self):
+        return {
+            "verdict": self.verdict,
+            "reason": self.reason,
+            "line": self.line,
+            "elapsed": None if self.decided_at is None else round(self.decided_at - self.started_at, 3),
+        }
+
+
+def load_rules(path):
+    with open(path) as f:
+        return BootRules.from_dict(json.load(f))
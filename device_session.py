@@ -0,0 +1,157 @@
+import os
+import time
+
+from flash_history import DIFF, SKIP
+from flasher_core import (DEFAULT_BAUD, FlashError, check_verification, connect, format_mac,
+                          verify_images, write_images)
+from serial_monitor import DEFAULT_MONITOR_BAUD, SerialMonitor
+from telemetry import MAC, MONITOR_START, RESET, VERIFY, span
+
+CHECK_INTERVAL = 0.05  # Seconds between boot check passes over new output
+
+
+class DeviceSession:
+    # One connection to one board: reset/sync and stub upload happen once, then
+    # flashing, MAC/chip reads and finally the serial monitor share it
+    def __init__(self, port, baud=DEFAULT_BAUD, chip=None, trace=None):
+        self.port = port
+        self.baud = baud
+        self.trace = trace  # telemetry.SessionTrace for per-phase timings
+        # Known chip (e.g. a package's) saves the detection round trip;
+        # esptool refuses to connect to a different one
+        self.expected_chip = chip
+        self.esp = None
+        self.chip = None
+        self.mac = None
+        self.reset_at = None
+
+    def connect(self):
+        import esptool
+        try:
+            self.esp = connect(self.port, self.baud, self.expected_chip, self.trace)
+            with span(self.trace, MAC):
+                self.chip = self.esp.get_chip_description()
+                self.mac = format_mac(self.esp.read_mac())
+        except esptool.FatalError as e:
+            self.close()
+            raise FlashError(str(e))
+        print(f"Chip is {self.chip}, MAC: {self.mac}")
+        return self
+
+    def flash(self, package, diff=False, on_progress=None, on_verify=None, plan=None):
+        # With on_verify, every image is checked once everything is written.
+        # plan(mac) may decide what happens to a board seen before: FLASH,
+        # SKIP (leave it as it is) or DIFF (write only what differs).
+        import esptool
+        action = plan(self.mac) if plan else None
+        if action == SKIP:
+            print(f"{self.mac} already has {os.path.basename(package.path)}, skipping it")
+            return 0
+        diff = diff or action == DIFF
+        from esptool.util import flash_size_bytes
+        try:
+            self.check_package(package)
+            self.esp.flash_set_parameters(flash_size_bytes(package.flash_size))
+            written = write_images(self.esp, package, diff, on_progress, self.trace)
+        except esptool.FatalError as e:
+            raise FlashError(str(e))
+        if on_verify:
+            self.verify(package, on_verify)
+        return written
+
+    def check_package(self, package):
+        # Refuse a package built for another chip or a bigger flash before
+        # anything is written
+        from esptool.cmds import DETECTED_FLASH_SIZES
+        from esptool.targets import CHIP_DEFS
+        from esptool.util import flash_size_bytes
+        if self.esp.CHIP_NAME != CHIP_DEFS[package.chip].CHIP_NAME:
+            raise FlashError(f"{os.path.basename(package.path)} is built for "
+                             f"{CHIP_DEFS[package.chip].CHIP_NAME}, but the board is {self.chip}")
+        detected = DETECTED_FLASH_SIZES.get((self.esp.flash_id() >> 16) & 0xFF)
+        if detected and flash_size_bytes(detected) < flash_size_bytes(package.flash_size):
+            raise FlashError(f"{os.path.basename(package.path)} needs {package.flash_size} of flash, "
+                             f"the board has {detected}")
+
+    def verify(self, package, on_verify=None):
+        # Per-image results go to on_verify before a mismatch is raised
+        import esptool
+        try:
+            with span(self.trace, VERIFY):
+                results = verify_images(self.esp, package)
+        except esptool.FatalError as e:
+            raise FlashError(str(e))
+        if on_verify:
+            on_verify(results)
+        check_verification(results)
+        return results
+
+    def hard_reset(self):
+        print("Leaving...")
+        with span(self.trace, RESET):
+            self.esp.hard_reset()
+        self.reset_at = time.time()
+
+    def handover(self, baud=DEFAULT_MONITOR_BAUD):
+        # Reset the board into its application and give the still open port
+        # to the caller (the serial monitor). The rate is switched before the
+        # reset so the first boot output is already read at the right speed.
+        serial_port = self.esp._port
+        serial_port.baudrate = baud
+        self.hard_reset()
+        self.esp = None
+        return serial_port
+
+    def close(self):
+        if self.esp is not None:
+            try:
+                self.esp._port.close()
+            except Exception:
+                print("Error closing serial port")
+            self.esp = None
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def flash_device(port, package, baud=DEFAULT_BAUD, diff=False, on_progress=None,
+                 on_verify=None, trace=None, plan=None):
+    # Flash a board and reset it into the new firmware; returns its MAC
+    with DeviceSession(port, baud, package.chip, trace) as session:
+        session.flash(package, diff, on_progress, on_verify, plan)
+        session.hard_reset()
+        return session.mac
+
+
+def flash_and_capture(port, package, baud=DEFAULT_BAUD, diff=False, on_progress=None, seconds=3.0, monitor_baud=DEFAULT_MONITOR_BAUD,
+                      on_verify=None, trace=None, logs=None, rules=None, plan=None):
+    # Flash a board, then collect what the new firmware prints for `seconds`
+    # (and write it to `logs`, a SerialLogStore). With boot_check.BootRules
+    # the capture instead ends as soon as the output passes or fails them.
+    # Returns (MAC, output lines, BootCheck or None).
+    with DeviceSession(port, baud, package.chip, trace) as session:
+        session.flash(package, diff, on_progress, on_verify, plan)
+        mac = session.mac
+        serial_port = session.handover(monitor_baud)
+        reset_at = session.reset_at
+        log = logs.open(mac or port) if logs else None
+        monitor = SerialMonitor(port, monitor_baud, serial_port=serial_port, log=log).start()
+    check = rules.check(reset_at) if rules else None
+    if check is None:
+        time.sleep(seconds)
+    else:
+        while not check.feed(monitor.drain()) and not check.expire():
+            if monitor.error:
+                break
+            time.sleep(CHECK_INTERVAL)
+    monitor.stop()
+    if check is not None and not check.done:
+        check.feed(monitor.drain())
+    if trace is not None and monitor.first_data_at:
+        trace.add(MONITOR_START, monitor.first_data_at - reset_at, reset_at)
+    if monitor.error:
+        raise FlashError(f"Serial monitor failed: {monitor.error}")
+    return mac, list(monitor.scrollback), check
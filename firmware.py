@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import io
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from firmware_manifest import PackageError, read_manifest, validate_manifest
+
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+# Granularity of differential flashing, a multiple of the 4 KB flash sector
+DIFF_SEGMENT_SIZE = 64 * 1024
+
+
+class FirmwareImage:
+    # One flash region, prepared exactly as esptool would send it: flash
+    # params patched into the bootloader header, padded, compressed once
+    def __init__(self, offset, name, data):
+        self.offset = offset
+        self.name = name
+        self.data = data
+        self.md5 = hashlib.md5(data).hexdigest()
+        self.compressed = zlib.compress(data, 9)
+        self._blocks = {}
+        self._segments = {}
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def compressed_size(self):
+        return len(self.compressed)
+
+    def blocks(self, block_size):
+        # (compressed block, bytes it inflates to) pairs for a loader's write size
+        if block_size not in self._blocks:
+            decompress = zlib.decompressobj()
+            view = memoryview(self.compressed)
+            blocks = []
+            for start in range(0, len(view), block_size):
+                block = view[start:start + block_size]
+                blocks.append((block, len(decompress.decompress(block))))
+            self._blocks[block_size] = blocks
+        return self._blocks[block_size]
+
+    def segments(self, segment_size=DIFF_SEGMENT_SIZE):
+        # (start, length, md5) of each segment, relative to the image offset
+        if segment_size not in self._segments:
+            self._segments[segment_size] = [
+                (start, len(self.data[start:start + segment_size]),
+                 hashlib.md5(self.data[start:start + segment_size]).hexdigest())
+                for start in range(0, len(self.data), segment_size)
+            ]
+        return self._segments[segment_size]
+
+    def slice(self, start, end):
+        # Part of this image as a region of its own, compressed independently.
+        # Not kept: which parts differ depends on the board, and cached slices
+        # would grow the package beyond its cache_size.
+        return FirmwareImage(self.offset + start, self.name, self.data[start:end])
+
+
+class FirmwarePackage:
+    def __init__(self, path, images, sha256=None, manifest=None):
+        self.path = path
+        self.images = images
+        self.sha256 = sha256
+        self.manifest = manifest
+        self.chip = manifest.chip
+        self.flash_mode = manifest.flash_mode
+        self.flash_freq = manifest.flash_freq
+        self.flash_size = manifest.flash_size
+
+    @classmethod
+    def load(cls, path, content=None):
+        import zipfile
+        if content is None:
+            with open(path, 'rb') as f:
+                content = f.read()
+        try:
+            with zipfile.ZipFile(io.BytesIO(content), 'r') as zip_ref:
+                files = {info.filename: zip_ref.read(info) for info in zip_ref.infolist()
+                         if not info.is_dir()}
+        except zipfile.BadZipFile as e:
+            raise PackageError(f"Invalid firmware package: {e}")
+
+        # Layout and flash settings are validated once per package; anything
+        # inconsistent is rejected here, before a board is touched
+        try:
+            manifest = read_manifest(files)
+            validate_manifest(manifest, files)
+        except PackageError as e:
+            raise PackageError(f"{os.path.basename(path)}: {e}")
+
+        package = cls(path, [], hashlib.sha256(content).hexdigest(), manifest)
+        for offset, name in manifest.images:
+            package.images.append(FirmwareImage(offset, name, package.prepare_image(offset, files[name])))
+        return package
+
+    def prepare_image(self, offset, data):
+        # esptool pads every image to a 4 byte boundary and rewrites the
+        # bootloader header; it only needs the chip class for that
+        from esptool.cmds import _update_image_flash_params
+        from esptool.targets import CHIP_DEFS
+        data = data + b'\xff' * (-len(data) % 4)
+        args = argparse.Namespace(chip=self.chip, flash_mode=self.flash_mode,
+                                  flash_freq=self.flash_freq, flash_size=self.flash_size)
+        return _update_image_flash_params(CHIP_DEFS[self.chip], offset, args, data)
+
+    def prefetch(self):
+        # Work a flash would otherwise do on first use: the stub's write
+        # blocks and the segment hashes differential flashing compares
+        from esptool.targets import CHIP_DEFS
+        block_size = CHIP_DEFS[self.chip].STUB_CLASS.FLASH_WRITE_SIZE
+        for image in self.images:
+            image.blocks(block_size)
+            image.segments()
+        return self
+
+    @property
+    def size(self):
+        return sum(image.size for image in self.images)
+
+    @property
+    def cache_size(self):
+        return sum(image.size + image.compressed_size for image in self.images)
+
+    def write_files(self, directory):
+        # Only needed by tools that insist on file paths (the esptool command line)
+        files = []
+        for image in self.images:
+            path = os.path.join(directory, *image.name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(image.data)
+            files.append((image.offset, path))
+        return files
+
+
+class PackageCache:
+    # Prepared packages keyed by the SHA-256 of the ZIP, evicted least
+    # recently used first once the total prepared size exceeds max_size
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._packages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        with open(path, 'rb') as f:
+            content = f.read()
+        key = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            package = self._packages.get(key)
+            if package is not None:
+                self._packages.move_to_end(key)
+                self.hits += 1
+                return package
+            self.misses += 1
+            package = FirmwarePackage.load(path, content)
+            self._packages[key] = package
+            self.size += package.cache_size
+            # Always keep the newest package, even if it alone exceeds the budget
+            while self.size > self.max_size and len(self._packages) > 1:
+                _, evicted = self._packages.popitem(last=False)
+                self.size -= evicted.cache_size
+            return package
+
+    def clear(self):
+        with self._lock:
+            self._packages.clear()
+            self.size = 0
+
+    def __contains__(self, sha256):
+        return sha256 in self._packages
+
+    def __len__(self):
+        return len(self._packages)
+
+
+package_cache = PackageCache()
+
+
+def load_package(path):
+    return package_cache.get(path)
@@ -0,0 +1,307 @@
+import hashlib
+import io
+import json
+import posixpath
+import struct
+
+# Where a package's files go and how the flash chip is driven. Packages can
+# declare it in a manifest.json, ship the flasher_args.json an ESP-IDF build
+# writes, or (Arduino/PlatformIO builds) have it worked out from the
+# bootloader's image header and the partition table:
+#
+#   {"chip": "esp32s3", "flash_mode": "qio", "flash_freq": "80m",
+#    "flash_size": "8MB",
+#    "flash_files": {"0x0": "bootloader.bin", "0x8000": "partitions.bin",
+#                    "0x10000": "firmware.bin"}}
+#
+# Flash settings left out of a manifest are taken from the bootloader header.
+
+MANIFEST_FILE = "manifest.json"
+IDF_FLASHER_ARGS = "flasher_args.json"
+
+# Member names of Arduino/PlatformIO packages without a manifest
+BOOTLOADER_FILE = "bootloader.bin"
+PARTITIONS_FILE = "partitions.bin"
+FIRMWARE_FILE = "firmware.bin"
+BOOT_APP0_FILE = "boot_app0.bin"  # Optional
+
+PARTITION_TABLE_OFFSET = 0x8000
+SECTOR_SIZE = 0x1000
+
+IMAGE_MAGIC = 0xE9
+IMAGE_HEADER_SIZE = 24  # Common header plus the extended header
+FLASH_MODES = {0: 'qio', 1: 'qout', 2: 'dio', 3: 'dout'}
+
+PARTITION_ENTRY = struct.Struct("<2sBBLL16sL")
+PARTITION_MAGIC = b'\xaa\x50'
+PARTITION_MD5_MAGIC = b'\xeb\xeb'
+APP_PARTITION = 0x00
+DATA_PARTITION = 0x01
+FACTORY_SUBTYPE = 0x00
+OTA_0_SUBTYPE = 0x10
+OTA_DATA_SUBTYPE = 0x00
+
+# Flash setting values that mean "whatever the image header says"; ESP-IDF
+# writes "detect" for flash_size when the build leaves it to esptool
+HEADER_SETTINGS = (None, "keep", "detect")
+
+
+class PackageError(Exception):
+    pass
+
+
+class FlashManifest:
+    def __init__(self, chip, flash_mode, flash_freq, flash_size, images, source):
+        self.chip = chip
+        self.flash_mode = flash_mode
+        self.flash_freq = flash_freq
+        self.flash_size = flash_size
+        self.images = sorted(images)  # (offset, member name) pairs
+        self.source = source  # Manifest member, or how the layout was inferred
+        self.partitions = []
+
+    def to_dict(self):
+        return {
+            "chip": self.chip,
+            "flash_mode": self.flash_mode,
+            "flash_freq": self.flash_freq,
+            "flash_size": self.flash_size,
+            "flash_files": {f"0x{offset:x}": name for offset, name in self.images},
+            "source": self.source,
+        }
+
+
+def chip_class(chip):
+    from esptool.targets import CHIP_DEFS
+    if chip not in CHIP_DEFS:
+        raise PackageError(f"Unknown chip '{chip}'")
+    return CHIP_DEFS[chip]
+
+
+def chip_for_image_id(chip_id):
+    from esptool.targets import CHIP_DEFS
+    for name, chip in CHIP_DEFS.items():
+        if getattr(chip, 'IMAGE_CHIP_ID', None) == chip_id:
+            return name
+    return None
+
+
+def parse_image_header(data, name):
+    if len(data) < IMAGE_HEADER_SIZE or data[0] != IMAGE_MAGIC:
+        raise PackageError(f"{name} is not an ESP image (no 0x{IMAGE_MAGIC:02X} header)")
+    return {
+        "flash_mode": data[2],
+        "flash_size_id": data[3] & 0xF0,
+        "flash_freq_id": data[3] & 0x0F,
+        "chip_id": struct.unpack_from("<H", data, 12)[0],
+    }
+
+
+def header_settings(data, name):
+    # Chip and flash settings a bootloader was built with
+    header = parse_image_header(data, name)
+    chip = chip_for_image_id(header["chip_id"])
+    if chip is None:
+        raise PackageError(f"{name} is built for an unknown chip (id {header['chip_id']})")
+    chip_def = chip_class(chip)
+    sizes = {value: size for size, value in chip_def.FLASH_SIZES.items()}
+    freqs = {value: freq for freq, value in chip_def.FLASH_FREQUENCY.items()}
+    return {
+        "chip": chip,
+        "flash_mode": FLASH_MODES.get(header["flash_mode"]),
+        "flash_freq": freqs.get(header["flash_freq_id"]),
+        "flash_size": sizes.get(header["flash_size_id"]),
+    }
+
+
+def parse_partition_table(data):
+    partitions = []
+    for start in range(0, len(data) - PARTITION_ENTRY.size + 1, PARTITION_ENTRY.size):
+        entry = data[start:start + PARTITION_ENTRY.size]
+        magic, type_, subtype, offset, size, label, flags = PARTITION_ENTRY.unpack(entry)
+        if magic == PARTITION_MD5_MAGIC:
+            # ESP-IDF's gen_esp32part.py closes the table with the MD5 of the
+            # entries before it; the bootloader refuses a table that does not match
+            if entry[16:] != hashlib.md5(data[:start]).digest():
+                raise PackageError("Partition table MD5 does not match, the table is corrupt")
+            break
+        if entry == b'\xff' * PARTITION_ENTRY.size:
+            break
+        if magic != PARTITION_MAGIC:
+            raise PackageError(f"Invalid partition table entry at byte {start}")
+        label = label.rstrip(b'\x00').decode('ascii', errors='replace')
+        if not size:
+            raise PackageError(f"Partition '{label}' at byte {start} of the table is empty")
+        if offset < PARTITION_TABLE_OFFSET:
+            raise PackageError(f"Partition '{label}' at 0x{offset:x} overlaps the bootloader "
+                               f"or the partition table")
+        partitions.append({
+            "label": label,
+            "type": type_,
+            "subtype": subtype,
+            "offset": offset,
+            "size": size,
+        })
+    if not partitions:
+        raise PackageError("Partition table is empty")
+    return partitions
+
+
+def first_app_partition(partitions):
+    apps = [p for p in partitions if p["type"] == APP_PARTITION]
+    for subtype in (FACTORY_SUBTYPE, OTA_0_SUBTYPE):
+        for partition in apps:
+            if partition["subtype"] == subtype:
+                return partition
+    return apps[0] if apps else None
+
+
+def find_manifest(members):
+    # The shallowest manifest.json or flasher_args.json, if any
+    candidates = [name for name in members
+                  if posixpath.basename(name) in (MANIFEST_FILE, IDF_FLASHER_ARGS)]
+    return min(candidates, key=lambda name: (name.count('/'), name)) if candidates else None
+
+
+def parse_offset(value):
+    try:
+        return int(value, 0) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError):
+        raise PackageError(f"Invalid flash offset {value!r} in manifest")
+
+
+def read_manifest(files):
+    # files: member name -> bytes
+    name = find_manifest(files)
+    if name is None:
+        return infer_manifest(files)
+    try:
+        declared = json.loads(files[name])
+    except ValueError as e:
+        raise PackageError(f"Invalid {name}: {e}")
+    if not isinstance(declared, dict) or not isinstance(declared.get("flash_files"), dict):
+        raise PackageError(f"{name} has no flash_files")
+    for member in declared["flash_files"].values():
+        if not isinstance(member, str):
+            raise PackageError(f"Invalid file name {member!r} in {name}")
+    for key in ("flash_settings", "extra_esptool_args"):  # flasher_args.json
+        if not isinstance(declared.get(key) or {}, dict):
+            raise PackageError(f"{key} in {name} must be an object")
+    settings = dict(declared.get("flash_settings") or {})
+    for key in ("flash_mode", "flash_freq", "flash_size"):
+        if key in declared:
+            settings[key] = declared[key]
+    chip = declared.get("chip") or (declared.get("extra_esptool_args") or {}).get("chip")
+    for key, value in dict(settings, chip=chip).items():
+        if value is not None and not isinstance(value, str):
+            raise PackageError(f"Invalid {key} {value!r} in {name}")
+
+    # File names are relative to the manifest
+    base = posixpath.dirname(name)
+    images = [(parse_offset(offset), posixpath.normpath(posixpath.join(base, member)))
+              for offset, member in declared["flash_files"].items()]
+
+    # Anything not declared comes from the bootloader the package carries
+    missing = [key for key in ("flash_mode", "flash_freq", "flash_size")
+               if settings.get(key) in HEADER_SETTINGS]
+    if missing or not chip:
+        bootloaders = [member for offset, member in sorted(images)
+                       if posixpath.basename(member) == BOOTLOADER_FILE or offset < PARTITION_TABLE_OFFSET]
+        if not bootloaders or bootloaders[0] not in files:
+            raise PackageError(f"{name} does not declare {', '.join(missing or ['chip'])} "
+                               f"and there is no bootloader to read it from")
+        detected = header_settings(files[bootloaders[0]], bootloaders[0])
+        chip = chip or detected["chip"]
+        for key in missing:
+            settings[key] = detected[key]
+    return FlashManifest(chip, settings["flash_mode"], settings["flash_freq"],
+                         settings["flash_size"], images, name)
+
+
+def infer_manifest(files):
+    for name in (BOOTLOADER_FILE, PARTITIONS_FILE, FIRMWARE_FILE):
+        if name not in files:
+            raise PackageError(f"{name} is missing and the package has no {MANIFEST_FILE}")
+    settings = header_settings(files[BOOTLOADER_FILE], BOOTLOADER_FILE)
+    partitions = parse_partition_table(files[PARTITIONS_FILE])
+    app = first_app_partition(partitions)
+    if app is None:
+        raise PackageError(f"{PARTITIONS_FILE} has no app partition for {FIRMWARE_FILE}")
+    images = [
+        (chip_class(settings["chip"]).BOOTLOADER_FLASH_OFFSET, BOOTLOADER_FILE),
+        (PARTITION_TABLE_OFFSET, PARTITIONS_FILE),
+        (app["offset"], FIRMWARE_FILE),
+    ]
+    otadata = [p for p in partitions if p["type"] == DATA_PARTITION and p["subtype"] == OTA_DATA_SUBTYPE]
+    if BOOT_APP0_FILE in files and otadata:
+        images.append((otadata[0]["offset"], BOOT_APP0_FILE))
+    return FlashManifest(settings["chip"], settings["flash_mode"], settings["flash_freq"],
+                         settings["flash_size"], images, "image headers")
+
+
+def validate_manifest(manifest, files):
+    # Everything that can be checked without a board; raises PackageError
+    from esptool.util import flash_size_bytes
+    chip_def = chip_class(manifest.chip)
+    if manifest.flash_mode not in FLASH_MODES.values():
+        raise PackageError(f"Unsupported flash mode '{manifest.flash_mode}'")
+    if manifest.flash_freq not in chip_def.FLASH_FREQUENCY:
+        raise PackageError(f"{chip_def.CHIP_NAME} does not support flash frequency "
+                           f"'{manifest.flash_freq}'")
+    if manifest.flash_size not in chip_def.FLASH_SIZES:
+        raise PackageError(f"{chip_def.CHIP_NAME} does not support flash size '{manifest.flash_size}'")
+    flash_size = flash_size_bytes(manifest.flash_size)
+    if not manifest.images:
+        raise PackageError("The package does not contain any images")
+
+    end = 0
+    for offset, name in manifest.images:
+        if name not in files:
+            raise PackageError(f"{name} is missing from the package")
+        if offset % SECTOR_SIZE:
+            raise PackageError(f"{name} at 0x{offset:x} is not aligned to a flash sector")
+        if offset < end:
+            raise PackageError(f"{name} at 0x{offset:x} overlaps the previous image")
+        end = offset + len(files[name])
+        if end > flash_size:
+            raise PackageError(f"{name} at 0x{offset:x} does not fit in {manifest.flash_size} of flash")
+
+    images = dict(manifest.images)
+    bootloader = images.get(chip_def.BOOTLOADER_FLASH_OFFSET)
+    if bootloader is not None:
+        check_image(files[bootloader], bootloader, manifest.chip)
+    if PARTITION_TABLE_OFFSET in images:
+        manifest.partitions = parse_partition_table(files[images[PARTITION_TABLE_OFFSET]])
+        for partition in manifest.partitions:
+            if partition["offset"] + partition["size"] > flash_size:
+                raise PackageError(f"Partition '{partition['label']}' ends beyond "
+                                   f"{manifest.flash_size} of flash")
+            name = images.get(partition["offset"])
+            if name is None or partition["type"] != APP_PARTITION:
+                continue
+            if len(files[name]) > partition["size"]:
+                raise PackageError(f"{name} is larger than partition '{partition['label']}'")
+            check_image(files[name], name, manifest.chip)
+
+
+def check_image_chip(data, name, chip):
+    built_for = chip_for_image_id(parse_image_header(data, name)["chip_id"])
+    if built_for != chip:
+        raise PackageError(f"{name} is built for {built_for or 'an unknown chip'}, "
+                           f"but the package is for {chip}")
+
+
+def check_image(data, name, chip):
+    # Chip, segment layout, checksum and appended SHA-256 of a bootloader or
+    # app image, as the ROM and the bootloader check them at boot
+    from esptool.bin_image import LoadFirmwareImage
+    from esptool.util import FatalError
+    check_image_chip(data, name, chip)
+    try:
+        image = LoadFirmwareImage(chip, io.BytesIO(data))
+    except (FatalError, RuntimeError, struct.error) as e:
+        raise PackageError(f"{name} is not a valid image: {e}")
+    if image.checksum != image.calculate_checksum():
+        raise PackageError(f"{name} fails its checksum, the image is corrupt")
+    if image.append_digest and image.stored_digest != image.calc_digest:
+        raise PackageError(f"{name} fails its SHA-256 digest, the image is corrupt")
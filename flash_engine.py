@@ -0,0 +1,252 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from firmware import load_package
+from baud_calibration import baud_for_port
+from boot_check import PASS
+from device_session import flash_and_capture, flash_device
+from flash_history import FLASH, SKIP, verified
+from flasher_core import FlashError
+from progress import ProgressThrottle
+from telemetry import COMPRESSION, span
+
+# Per-device states
+PENDING = "pending"
+FLASHING = "flashing"
+RETRYING = "retrying"
+SUCCESS = "success"
+FAILED = "failed"
+
+
+class DeviceResult:
+    def __init__(self, port):
+        self.port = port
+        self.state = PENDING
+        self.attempts = 0
+        self.error = None
+        self.progress = None  # Last FlashProgress snapshot
+        self.mac = None
+        self.output = []  # Serial output after flashing, when monitored
+        self.verification = None  # Per-image results, when verified
+        self.boot = None  # Boot check verdict, when checked
+        self.action = None  # FLASH, SKIP or DIFF, when the history was asked
+        self.timings = None  # Seconds per phase of the last attempt, with telemetry
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def to_dict(self):
+        return {
+            "port": self.port,
+            "state": self.state,
+            "attempts": self.attempts,
+            "mac": self.mac,
+            "error": self.error,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "verification": self.verification,
+            "boot": self.boot,
+            "action": self.action,
+            "timings": self.timings,
+            "output": self.output,
+        }
+
+
+class FlashEngine:
+    # Flashes one firmware package onto many ports through a bounded worker pool.
+    # Ports may be device names or pyserial URLs (socket://, loop://, ...).
+    def __init__(self, zip_file, ports, max_workers=4, retries=1, baud=None,
+                 retry_delay=1.0, diff=False, verify=False, monitor_seconds=0, flash_func=None,
+                 capture_func=None, on_update=None, on_progress=None, telemetry=None, logs=None,
+                 boot_rules=None, history=None, known_boards=FLASH):
+        self.zip_file = zip_file
+        self.ports = list(ports)
+        self.max_workers = max(1, max_workers)
+        self.retries = max(0, retries)
+        # None means each port's calibrated rate (see baud_calibration)
+        self.baud = baud
+        self.retry_delay = retry_delay
+        # Only write the flash regions whose on-device MD5 differs
+        self.diff = diff
+        # Compare on-device MD5s of every image after writing
+        self.verify = verify
+        # Seconds of serial output to keep per device after flashing, 0 for none
+        self.monitor_seconds = monitor_seconds
+        # flash_func flashes a board; capture_func flashes it and captures its
+        # output (see device_session.flash_and_capture) when monitor_seconds or
+        # boot_rules ask for that. A custom flash_func would be bypassed then,
+        # so it needs a matching capture_func.
+        if flash_func and not capture_func and (monitor_seconds or boot_rules):
+            raise ValueError("flash_func is not used when capturing output, pass capture_func too")
+        self.flash_func = flash_func or flash_device
+        self.capture_func = capture_func or flash_and_capture
+        self.on_update = on_update
+        self.on_progress = on_progress
+        # telemetry.Telemetry that gets a trace per attempt
+        self.telemetry = telemetry
+        # serial_log.SerialLogStore for the monitored output, keyed by MAC
+        self.logs = logs
+        # boot_check.BootRules every board's boot output has to pass; the
+        # capture ends as soon as a verdict is in
+        self.boot_rules = boot_rules
+        # flash_history.FlashHistory every board's outcome is recorded in, and
+        # what to do with boards it says already have the package
+        self.history = history
+        self.known_boards = known_boards
+        self.results = {port: DeviceResult(port) for port in self.ports}
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        self.started_at = time.time()
+        # Prepare the package once (or reuse the cached one); every worker
+        # flashes from the same precompressed buffers
+        trace = self.telemetry.trace(None, stage="package") if self.telemetry else None
+        with span(trace, COMPRESSION):
+            package = load_package(self.zip_file).prefetch()
+        if trace is not None:
+            self.telemetry.finish(trace, SUCCESS)
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                thread_name_prefix="flash") as pool:
+            futures = [(port, pool.submit(self._flash_port, port, package)) for port in self.ports]
+            for port, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    # Escaped the attempt loop (a history or callback error);
+                    # the board must not stay "flashing"
+                    self._fail(self.results[port], e)
+        self.finished_at = time.time()
+        return [self.results[port] for port in self.ports]
+
+    def _flash_port(self, port, package):
+        result = self.results[port]
+        result.started_at = time.time()
+        while True:
+            result.attempts += 1
+            result.verification = result.boot = None  # Only the last attempt's
+            self._set_state(result, FLASHING)
+            # Only passed when used, so custom flash functions need not take them
+            extra = {}
+            try:
+                on_progress = ProgressThrottle(lambda snapshot: self._progress(result, snapshot))
+                baud = self.baud or baud_for_port(port)
+                on_verify = self._verified(result) if self.verify else None
+                if self.telemetry:
+                    extra["trace"] = self.telemetry.trace(port, attempt=result.attempts)
+                if self.history:
+                    extra["plan"] = self._planner(result, package)
+                if self.monitor_seconds or self.boot_rules:
+                    result.mac, result.output, check = self.capture_func(
+                        port, package, baud, diff=self.diff, on_progress=on_progress,
+                        seconds=self.monitor_seconds, on_verify=on_verify, logs=self.logs,
+                        rules=self.boot_rules, **extra)
+                    if check is not None:
+                        result.boot = check.to_dict()
+                        if check.verdict != PASS:
+                            raise FlashError(f"Boot check failed: {check.reason}")
+                else:
+                    result.mac = self.flash_func(port, package, baud, diff=self.diff,
+                                                 on_progress=on_progress, on_verify=on_verify,
+                                                 **extra)
+            except Exception as e:
+                self._finish_trace(result, extra, FAILED)
+                result.error = str(e)
+                print(f"{port}: attempt {result.attempts} failed: {e}")
+                if result.attempts > self.retries:
+                    result.finished_at = time.time()
+                    self._record(result, package, FAILED)
+                    self._set_state(result, FAILED)
+                    return
+                self._set_state(result, RETRYING)
+                time.sleep(self.retry_delay)
+            else:
+                self._finish_trace(result, extra, SUCCESS)
+                result.error = None
+                result.finished_at = time.time()
+                self._record(result, package, SUCCESS)
+                self._set_state(result, SUCCESS)
+                return
+
+    def _fail(self, result, error):
+        print(f"{result.port}: failed: {error}")
+        if result.state in (SUCCESS, FAILED):
+            return  # Only reporting the outcome went wrong
+        result.error = result.error or str(error)
+        result.finished_at = result.finished_at or time.time()
+        with self._lock:
+            result.state = FAILED
+        if self.on_update:
+            try:
+                self.on_update(result)
+            except Exception as e:
+                print(f"{result.port}: error reporting the result: {e}")
+
+    def _finish_trace(self, result, extra, state):
+        if "trace" in extra:
+            self.telemetry.finish(extra["trace"], state)
+            result.timings = extra["trace"].totals()
+
+    def _planner(self, result, package):
+        def plan(mac):
+            result.mac = mac
+            result.action = self.history.known_board_action(mac, package.sha256, self.known_boards)
+            return result.action
+        return plan
+
+    def _record(self, result, package, state):
+        if self.history is None:
+            return
+        self.history.record(mac=result.mac, port=result.port, package_sha256=package.sha256,
+                            package=package.path, chip=package.chip, action=result.action,
+                            result=state, error=result.error,
+                            verified=verified(result.verification),
+                            boot=result.boot and result.boot["verdict"],
+                            started_at=result.started_at, duration=result.duration)
+
+    def _verified(self, result):
+        def record(verification):
+            result.verification = verification
+        return record
+
+    def _progress(self, result, snapshot):
+        result.progress = snapshot
+        if self.on_progress:
+            self.on_progress(result)
+
+    def _set_state(self, result, state):
+        with self._lock:
+            result.state = state
+        if self.on_update:
+            self.on_update(result)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def boards_per_hour(self):
+        succeeded = sum(1 for r in self.results.values() if r.state == SUCCESS)
+        if self.elapsed <= 0:
+            return 0.0
+        return succeeded * 3600.0 / self.elapsed
+
+    def summary(self):
+        states = [r.state for r in self.results.values()]
+        return {
+            "total": len(states),
+            "succeeded": states.count(SUCCESS),
+            "failed": states.count(FAILED),
+            "skipped": sum(1 for r in self.results.values() if r.action == SKIP),
+            "elapsed": self.elapsed,
+            "boards_per_hour": self.boards_per_hour(),
+            "devices": [self.results[port].to_dict() for port in self.ports],
+        }
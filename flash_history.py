@@ -0,0 +1,204 @@
+import argparse
+import contextlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+# Every flash session in a local SQLite database: which board (MAC) got which
+# package (SHA-256 of the ZIP), when, and how it went. Sessions are queued
+# and written by a background thread in batches, so recording never waits on
+# the disk. Runners ask it whether a board still has a package (its latest
+# session succeeded with it) to skip it or flash only the differences.
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 1.0  # Seconds a session may wait in the queue
+
+# What to do with a board that already has the package
+FLASH = "flash"
+SKIP = "skip"
+DIFF = "diff"
+KNOWN_BOARD_ACTIONS = [FLASH, SKIP, DIFF]
+
+# Session results
+SUCCESS = "success"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+COLUMNS = ["mac", "port", "package_sha256", "package", "chip", "action", "result", "error",
+           "verified", "boot", "started_at", "duration"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    mac TEXT,
+    port TEXT,
+    package_sha256 TEXT,
+    package TEXT,
+    chip TEXT,
+    action TEXT,
+    result TEXT NOT NULL,
+    error TEXT,
+    verified INTEGER,
+    boot TEXT,
+    started_at REAL NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_mac ON sessions (mac, started_at);
+CREATE INDEX IF NOT EXISTS sessions_package ON sessions (package_sha256, started_at);
+CREATE INDEX IF NOT EXISTS sessions_started_at ON sessions (started_at);
+"""
+
+
+class FlashHistory:
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # mac -> (package SHA-256, result) of the latest session this process
+        # recorded, so lookups see it before the batch that holds it is written
+        self._latest = {}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        with contextlib.closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def record(self, **session):
+        # Queue one session; see COLUMNS for the fields
+        unknown = set(session) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown session fields: {', '.join(sorted(unknown))}")
+        session.setdefault("started_at", time.time())
+        if session.get("mac"):
+            self._latest[session["mac"]] = (session.get("package_sha256"), session.get("result"))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write, daemon=True,
+                                                 name="flash-history")
+                self._thread.start()
+        self._queue.put(tuple(session.get(column) for column in COLUMNS))
+
+    def flush(self):
+        # Wait until everything recorded so far is in the database
+        self._queue.join()
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def _write(self):
+        insert = (f"INSERT INTO sessions ({', '.join(COLUMNS)}) "
+                  f"VALUES ({', '.join('?' for _ in COLUMNS)})")
+        with contextlib.closing(self._connect()) as db:
+            while True:
+                rows = [self._queue.get()]
+                deadline = time.time() + self.flush_interval
+                while rows[-1] is not None and len(rows) < self.batch_size:
+                    try:
+                        rows.append(self._queue.get(timeout=max(0, deadline - time.time())))
+                    except queue.Empty:
+                        break
+                stop = rows[-1] is None
+                batch = [row for row in rows if row is not None]
+                try:
+                    with db:
+                        db.executemany(insert, batch)
+                except sqlite3.Error as e:
+                    print(f"Error writing {len(batch)} sessions to {self.path}: {e}")
+                for _ in rows:
+                    self._queue.task_done()
+                if stop:
+                    return
+
+    # Queries
+
+    def flashed(self, mac, package_sha256):
+        # Whether the board still has this package: its latest session wrote
+        # it successfully. Any later session, even a failed one, may have
+        # written something else.
+        latest = self._latest.get(mac)
+        if latest is None:
+            with contextlib.closing(self._connect()) as db:
+                latest = db.execute("SELECT package_sha256, result FROM sessions WHERE mac = ? "
+                                    "ORDER BY started_at DESC, id DESC LIMIT 1", (mac,)).fetchone()
+        return latest is not None and tuple(latest) == (package_sha256, SUCCESS)
+
+    def last(self, mac, package_sha256=None, result=SUCCESS):
+        # The board's latest session (with that package, that result), or None
+        sessions = self.sessions(mac=mac, package_sha256=package_sha256, result=result, limit=1)
+        return sessions[0] if sessions else None
+
+    def sessions(self, mac=None, package_sha256=None, result=None, since=None, until=None,
+                 limit=None):
+        # Matching sessions, newest first
+        where = []
+        params = []
+        for column, value in (("mac", mac), ("package_sha256", package_sha256), ("result", result)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("started_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("started_at <= ?")
+            params.append(until)
+        query = "SELECT * FROM sessions"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY started_at DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with contextlib.closing(self._connect()) as db:
+            return [dict(row) for row in db.execute(query, params)]
+
+    def counts(self, package_sha256=None):
+        # {result: number of distinct boards}, for one package or all
+        query = "SELECT result, COUNT(DISTINCT mac) FROM sessions"
+        params = []
+        if package_sha256 is not None:
+            query += " WHERE package_sha256 = ?"
+            params.append(package_sha256)
+        with contextlib.closing(self._connect()) as db:
+            return dict(db.execute(query + " GROUP BY result", params).fetchall())
+
+    def known_board_action(self, mac, package_sha256, action):
+        # What to do with a board about to be flashed under a known-board policy
+        if action == FLASH or not mac or not self.flashed(mac, package_sha256):
+            return FLASH
+        return action
+
+
+def verified(verification):
+    # The "verified" column: 1 when every image matched, 0 when one did not,
+    # None when the session did not get to verify
+    if not verification:
+        return None
+    return int(all(result["ok"] for result in verification))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the flash history")
+    parser.add_argument("database")
+    parser.add_argument("--mac")
+    parser.add_argument("--package", help="SHA-256 of the package ZIP")
+    parser.add_argument("--result")
+    parser.add_argument("--since", type=float, help="Epoch seconds")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+    history = FlashHistory(args.database)
+    for session in history.sessions(args.mac, args.package, args.result, args.since,
+                                    limit=args.limit):
+        print(json.dumps(session))
@@ -0,0 +1,262 @@
+import argparse
+import contextlib
+import fnmatch
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from serial.tools import list_ports
+
+from boot_check import BootRules
+from firmware import PackageError, load_package
+from flash_engine import FAILED, SUCCESS, FlashEngine
+from flash_history import FLASH, KNOWN_BOARD_ACTIONS, FlashHistory
+from port_watcher import is_mcu_port
+from serial_log import SerialLogStore
+from telemetry import Telemetry
+
+# Headless entry point for stations, CI and the MES: no Tk, ttkbootstrap or
+# pyperclip. A job manifest looks like
+#
+#   {"package": "release/fw.zip", "ports": "/dev/ttyUSB*", "count": 4,
+#    "workers": 4, "retries": 1, "baud": null, "diff": false, "verify": true,
+#    "monitor": 3, "timeout": 30, "telemetry": "timings.jsonl",
+#    "prometheus": "flasher.prom", "logs": "logs",
+#    "boot": {"expected": ["Setup done"], "timeout": 10},
+#    "history": "history.sqlite3", "known_boards": "skip"}
+#
+# "ports" is a glob (or a list of globs) matched against serial device names;
+# pyserial URLs such as socket://host:port are used as given. The package path
+# is relative to the manifest. Results are written as JSON lines, one per
+# device as it finishes plus a final summary; everything else goes to stderr.
+# With "telemetry" each session's phase timings are appended there as JSON
+# lines and the summary gets p50/p95 per phase; "prometheus" writes the same
+# numbers in the Prometheus text format (e.g. for node_exporter's textfile
+# collector). "logs" keeps the monitored output of every board there, keyed by
+# MAC (see serial_log). With "boot" a board only succeeds once its boot
+# output passes those rules (see boot_check); a failed boot counts as a failed
+# attempt. "history" records every board in a SQLite database (see
+# flash_history); boards it says already have the package are flashed anyway,
+# skipped or diff-flashed according to "known_boards".
+
+DEFAULT_JOB = {
+    "ports": None,  # Any port that looks like a USB-serial MCU adapter
+    "count": None,  # Every matching port
+    "workers": 4,
+    "retries": 1,
+    "baud": None,  # Calibrated rate per adapter
+    "diff": False,
+    "verify": False,  # Compare on-device MD5s after writing
+    "monitor": 0,  # Seconds of serial output to capture per device
+    "timeout": 0,  # Seconds to wait for `count` ports to show up
+    "telemetry": None,  # JSON lines file for per-phase timings
+    "prometheus": None,  # Prometheus text file for the same
+    "logs": None,  # Directory for the monitored serial output
+    "boot": None,  # Boot check rules
+    "history": None,  # SQLite database of flash sessions
+    "known_boards": FLASH,  # flash, skip or diff boards the history has seen with the package
+}
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_JOB_ERROR = 2
+
+
+class JobError(Exception):
+    pass
+
+
+def load_job(path):
+    try:
+        with open(path) as f:
+            job = json.load(f)
+    except (OSError, ValueError) as e:
+        raise JobError(f"Cannot read job manifest {path}: {e}")
+    if not isinstance(job, dict):
+        raise JobError(f"Job manifest {path} must be a JSON object")
+    for key in ("package", "telemetry", "prometheus", "logs", "history"):
+        if job.get(key) and not os.path.isabs(job[key]):
+            job[key] = os.path.join(os.path.dirname(os.path.abspath(path)), job[key])
+    return job
+
+
+def make_job(manifest=None, **overrides):
+    job = dict(DEFAULT_JOB)
+    if manifest:
+        job.update(load_job(manifest))
+    # Boot check settings given on the command line refine the manifest's
+    boot = overrides.pop("boot", None)
+    job.update({key: value for key, value in overrides.items() if value is not None})
+    if boot:
+        job["boot"] = dict(job["boot"] if isinstance(job["boot"], dict) else {}, **boot)
+    unknown = set(job) - set(DEFAULT_JOB) - {"package"}
+    if unknown:
+        raise JobError(f"Unknown job settings: {', '.join(sorted(unknown))}")
+    if not job.get("package"):
+        raise JobError("No firmware package given")
+    if not os.path.isfile(job["package"]):
+        raise JobError(f"Firmware package not found: {job['package']}")
+    if isinstance(job["ports"], str):
+        job["ports"] = [job["ports"]]
+    if job["known_boards"] not in KNOWN_BOARD_ACTIONS:
+        raise JobError(f"\"known_boards\" must be one of {', '.join(KNOWN_BOARD_ACTIONS)}")
+    if job["known_boards"] != FLASH and not job["history"]:
+        raise JobError(f"\"known_boards\": \"{job['known_boards']}\" needs a \"history\" database")
+    if job["boot"] is not None:
+        if not isinstance(job["boot"], dict):
+            raise JobError("\"boot\" must be a JSON object")
+        try:
+            job["boot_rules"] = BootRules.from_dict(job["boot"])
+        except ValueError as e:
+            raise JobError(str(e))
+    return job
+
+
+def match_ports(patterns):
+    if not patterns:
+        return [info.device for info in list_ports.comports() if is_mcu_port(info)]
+    ports = [pattern for pattern in patterns if "://" in pattern]
+    globs = [pattern for pattern in patterns if "://" not in pattern]
+    if globs:
+        devices = sorted(info.device for info in list_ports.comports())
+        ports += [device for device in devices
+                  if any(fnmatch.fnmatch(device, pattern) for pattern in globs)]
+    return ports
+
+
+def wait_for_ports(patterns, count=None, timeout=0, poll_interval=0.5):
+    deadline = time.time() + timeout
+    while True:
+        ports = match_ports(patterns)
+        if count is None or len(ports) >= count or time.time() >= deadline:
+            return ports[:count] if count is not None else ports
+        time.sleep(poll_interval)
+
+
+def write_result(out, record):
+    out.write(json.dumps(record) + "\n")
+    out.flush()
+
+
+def run_job(job, out):
+    # Check and prepare the package before waiting for boards, so a bad one
+    # fails the job without touching any
+    try:
+        load_package(job["package"]).prefetch()
+    except PackageError as e:
+        raise JobError(str(e))
+    except Exception as e:
+        raise JobError(f"Cannot prepare {job['package']}: {e}")
+    try:
+        history = FlashHistory(job["history"]) if job["history"] else None
+    except sqlite3.Error as e:
+        raise JobError(f"Cannot open the history database {job['history']}: {e}")
+    ports = wait_for_ports(job["ports"], job["count"], job["timeout"])
+    if not ports:
+        raise JobError("No matching serial ports found")
+    if job["count"] is not None and len(ports) < job["count"]:
+        print(f"Only {len(ports)} of {job['count']} ports found, flashing those")
+
+    def on_update(result):
+        if result.state in (SUCCESS, FAILED):
+            write_result(out, dict(result.to_dict(), type="device"))
+
+    tracing = job["telemetry"] or job["prometheus"]
+    sink = open(job["telemetry"], "a") if job["telemetry"] else None
+    telemetry = Telemetry(sink) if tracing else None
+    logs = SerialLogStore(job["logs"]) if job["logs"] else None
+    try:
+        engine = FlashEngine(job["package"], ports, max_workers=job["workers"],
+                             retries=job["retries"], baud=job["baud"], diff=job["diff"],
+                             verify=job["verify"], monitor_seconds=job["monitor"],
+                             on_update=on_update, telemetry=telemetry, logs=logs,
+                             boot_rules=job.get("boot_rules"), history=history,
+                             known_boards=job["known_boards"])
+        engine.run()
+    finally:
+        if history is not None:
+            history.close()
+        if sink is not None:
+            sink.close()
+        if logs is not None:
+            logs.close()
+    summary = engine.summary()
+    del summary["devices"]
+    if telemetry:
+        summary["phases"] = telemetry.summary().get(None, {})
+        if job["prometheus"]:
+            with open(job["prometheus"], "w") as f:
+                f.write(telemetry.prometheus())
+    write_result(out, dict(summary, type="summary", package=job["package"],
+                           expected=job["count"]))
+    # Skipped boards end in the success state and count as succeeded; a board
+    # left in any other state (or one of `count` that never showed up) fails the job
+    expected = max(summary["total"], job["count"] or 0)
+    if summary["failed"] or summary["succeeded"] < expected:
+        return EXIT_FAILED
+    return EXIT_OK
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flash ESP32 boards without the GUI")
+    parser.add_argument("manifest", nargs="?", help="JSON job manifest")
+    parser.add_argument("--package", help="Firmware package (.zip)")
+    parser.add_argument("--ports", action="append",
+                        help="Port glob or pyserial URL, may be repeated")
+    parser.add_argument("--count", type=int, help="Number of boards to flash")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--retries", type=int)
+    parser.add_argument("--baud", type=int)
+    parser.add_argument("--diff", action="store_true", default=None,
+                        help="Only write regions that differ from the board")
+    parser.add_argument("--verify", action="store_true", default=None,
+                        help="Check every image against its MD5 on the board after writing")
+    parser.add_argument("--monitor", type=float,
+                        help="Seconds of serial output to capture after flashing")
+    parser.add_argument("--timeout", type=float, help="Seconds to wait for the ports")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    parser.add_argument("--telemetry", help="Append per-phase timings here as JSON lines")
+    parser.add_argument("--prometheus", help="Write per-phase timings here as Prometheus text")
+    parser.add_argument("--logs", help="Keep the monitored serial output in this directory")
+    parser.add_argument("--expect", action="append",
+                        help="Boot output a board must print to pass, may be repeated")
+    parser.add_argument("--forbid", action="append",
+                        help="Boot output that fails a board, may be repeated "
+                             "(replaces the default list)")
+    parser.add_argument("--boot-timeout", type=float,
+                        help="Seconds a board has to pass the boot check")
+    parser.add_argument("--history", help="Record every board in this SQLite database")
+    parser.add_argument("--known-boards", choices=KNOWN_BOARD_ACTIONS,
+                        help="What to do with boards the history has seen with this package")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        # Keep stdout for results only; flashing chatter goes to stderr
+        with contextlib.redirect_stdout(sys.stderr):
+            boot = None
+            if args.expect or args.forbid or args.boot_timeout is not None:
+                boot = {key: value for key, value in (("expected", args.expect),
+                                                      ("forbidden", args.forbid),
+                                                      ("timeout", args.boot_timeout))
+                        if value is not None}
+            job = make_job(args.manifest, package=args.package, ports=args.ports,
+                           count=args.count, workers=args.workers, retries=args.retries,
+                           baud=args.baud, diff=args.diff, verify=args.verify,
+                           monitor=args.monitor, timeout=args.timeout,
+                           telemetry=args.telemetry, prometheus=args.prometheus, logs=args.logs,
+                           boot=boot, history=args.history, known_boards=args.known_boards)
+            return run_job(job, out)
+    except JobError as e:
+        write_result(out, {"type": "error", "error": str(e)})
+        return EXIT_JOB_ERROR
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
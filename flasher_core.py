@@ -0,0 +1,184 @@
+import os
+import sys
+import time
+
+# esptool is imported where it is used: it is a large part of the GUI's
+# startup time and not needed before the first flash. It runs in-process on
+# every OS, so progress, verification and the MAC come back as data rather
+# than as console text.
+
+from firmware import DIFF_SEGMENT_SIZE
+from progress import FlashProgress
+from telemetry import BAUD_CHANGE, DIFF, PORT_OPEN, RESET_SYNC, STUB, WRITE, span
+
+DEFAULT_BAUD = 921600
+# Per-user state (baud profiles, ...) kept outside the install directory
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".esp32flasher")
+
+
+class FlashError(Exception):
+    pass
+
+
+def ensure_output_streams(path=os.devnull):
+    # A windowed build (console=False) has no stdout/stderr, and esptool
+    # flushes sys.stdout on every connect; give them a file to go to
+    if sys.stdout is None or sys.stderr is None:
+        stream = open(path, "a", buffering=1)
+        sys.stdout = sys.stdout or stream
+        sys.stderr = sys.stderr or stream
+
+
+def data_path(name):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, name)
+
+
+def reset_mode(port):
+    # pyserial URL stand-ins (socket://, loop://) have no modem lines to reset with
+    return 'no_reset' if '://' in port else 'default_reset'
+
+
+def connect(port, baud=DEFAULT_BAUD, chip=None, trace=None):
+    # Same sequence esptool.main runs before an operation: sync at the ROM
+    # baud rate (detecting the chip unless one is given), upload the stub,
+    # then switch to the requested speed
+    from esptool.cmds import detect_chip
+    from esptool.loader import ESPLoader
+    from esptool.targets import CHIP_DEFS
+    ensure_output_streams()
+    initial_baud = min(ESPLoader.ESP_ROM_BAUD, baud)
+    if chip is None:
+        # Opens the port too
+        with span(trace, RESET_SYNC, detect=True):
+            esp = detect_chip(port, initial_baud, reset_mode(port))
+    else:
+        with span(trace, PORT_OPEN):
+            esp = CHIP_DEFS[chip](port, initial_baud)
+    try:
+        if chip is not None:
+            with span(trace, RESET_SYNC):
+                esp.connect(reset_mode(port))
+        with span(trace, STUB):
+            esp = esp.run_stub()
+        if baud > initial_baud:
+            with span(trace, BAUD_CHANGE, baud=baud):
+                esp.change_baud(baud)
+    except Exception:
+        esp._port.close()
+        raise
+    return esp
+
+
+def diff_regions(esp, image, segment_size=DIFF_SEGMENT_SIZE):
+    # Hash the image's flash range on the device and return only the parts
+    # that differ from the host copy, adjacent segments merged into one write
+    if esp.flash_md5sum(image.offset, image.size) == image.md5:
+        return []
+    runs = []
+    for start, length, md5 in image.segments(segment_size):
+        if esp.flash_md5sum(image.offset + start, length) == md5:
+            continue
+        if runs and runs[-1][1] == start:
+            runs[-1][1] = start + length
+        else:
+            runs.append([start, start + length])
+    return [image.slice(start, end) for start, end in runs]
+
+
+def write_region(esp, region, progress=None, on_progress=None):
+    # esptool's write_flash loop, fed with the region's precompressed blocks
+    from esptool.loader import (DEFAULT_TIMEOUT, ERASE_WRITE_TIMEOUT_PER_MB, ESPLoader,
+                                timeout_per_mb)
+    if progress:
+        progress.start_region(region.name, region.offset)
+    esp.flash_defl_begin(region.size, region.compressed_size, region.offset)
+    timeout = DEFAULT_TIMEOUT
+    t = time.time()
+    for seq, (block, inflated_size) in enumerate(region.blocks(esp.FLASH_WRITE_SIZE)):
+        block_timeout = max(DEFAULT_TIMEOUT,
+                            timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, inflated_size))
+        if not esp.IS_STUB:
+            timeout = block_timeout  # ROM code writes block to flash before ACKing
+        esp.flash_defl_block(block, seq, timeout=timeout)
+        if esp.IS_STUB:
+            # Stub ACKs on receive and writes while the next block arrives
+            timeout = block_timeout
+        if progress:
+            progress.advance(inflated_size, len(block))
+            if on_progress:
+                on_progress(progress)
+    if esp.IS_STUB:
+        # Not ACKed until the last block has actually been written out
+        esp.read_reg(ESPLoader.CHIP_DETECT_MAGIC_REG_ADDR, timeout=timeout)
+    print("Wrote %d bytes (%d compressed) at 0x%08x in %.1f seconds..."
+          % (region.size, region.compressed_size, region.offset, time.time() - t))
+
+    if esp.flash_md5sum(region.offset, region.size) != region.md5:
+        raise FlashError(f"MD5 of {region.name} does not match data in flash!")
+    print("Hash of data verified.")
+
+
+def write_images(esp, package, diff=False, on_progress=None, trace=None):
+    if any(image.offset < 0x8000 for image in package.images) and esp.get_secure_boot_enabled():
+        raise FlashError("Secure Boot detected, writing to flash regions < 0x8000 is disabled "
+                         "to protect the bootloader.")
+    regions = list(package.images)
+    if diff:
+        with span(trace, DIFF):
+            regions = []
+            for image in package.images:
+                changed = diff_regions(esp, image)
+                if not changed:
+                    print(f"{image.name} at 0x{image.offset:08x} is unchanged, skipping.")
+                regions.extend(changed)
+
+    # Progress is measured against what will really be written
+    progress = FlashProgress(esp.serial_port, sum(region.size for region in regions))
+    with span(trace, WRITE, regions=len(regions), bytes=progress.total) as attrs:
+        for region in regions:
+            write_region(esp, region, progress, on_progress)
+
+        if esp.IS_STUB and regions:
+            # Leave the stub running; flash_finish would hand control to the ROM
+            esp.flash_begin(0, 0)
+            esp.flash_defl_finish(False)
+        attrs["sent"] = progress.sent
+    progress.finish()
+    if on_progress:
+        on_progress(progress)
+    return progress.total
+
+
+def verify_images(esp, package):
+    # Let the stub hash each image's flash range and compare with the digest
+    # computed when the package was loaded; one command per image instead
+    # of reading the flash back over the serial link
+    results = []
+    for image in package.images:
+        t = time.time()
+        digest = esp.flash_md5sum(image.offset, image.size)
+        results.append(verify_result(image, digest == image.md5, digest, round(time.time() - t, 4)))
+    return results
+
+
+def verify_result(image, ok, md5=None, seconds=None):
+    return {
+        "name": image.name,
+        "offset": image.offset,
+        "size": image.size,
+        "md5": md5,
+        "ok": ok,
+        "seconds": seconds,
+    }
+
+
+def check_verification(results):
+    failed = [f"{result['name']} at 0x{result['offset']:08x}" for result in results if not result["ok"]]
+    if failed:
+        raise FlashError(f"Verification failed, flash does not match: {', '.join(failed)}")
+    print(f"Verified {len(results)} regions against their MD5 digests.")
+
+
+def format_mac(mac):
+    return ":".join(f"{byte:02x}" for byte in mac)
@@ -1,17 +1,22 @@
-import subprocess
-import sys
-import serial
+import serial.tools.list_ports
 from tkinter import filedialog, messagebox, scrolledtext
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
-import threading
-import io
-import time
-import zipfile
-import re
-import pyperclip
+import queue
 import os
-import esptool
+from boot_check import PASS, BootRules, load_rules
+from flash_history import FlashHistory
+from flasher_core import data_path, ensure_output_streams
+from orchestrator import (BOOT_CHECKED, FLASH_CANCELLED, FLASH_DONE, FLASH_FAILED, FLASH_PROGRESS,
+                          MONITOR_LINES, MONITOR_STOPPED, PACKAGE_FAILED, PACKAGE_READY,
+                          PORTS_CHANGED, DeviceOrchestrator)
+from port_watcher import is_mcu_port
+from progress import format_progress
+from serial_log import SerialLogStore
+from serial_monitor import DEFAULT_MONITOR_BAUD, MAX_SCROLLBACK, MONITOR_BAUD_RATES
+from telemetry import Telemetry
+
+UI_FRAME_MS = 33  # Device events and serial monitor redraw interval (~30 fps)
 
 class ESP32Flasher:
     def __init__(self, root):
@@ -32,30 +37,50 @@ class ESP32Flasher:
         self.port = tb.StringVar()
         self.progress_var = tb.IntVar()
         self.progress_text = tb.StringVar()
+        self.diff_flash = tb.BooleanVar(value=False)
+        self.auto_flash = tb.BooleanVar(value=False)
+        self.verify_flash = tb.BooleanVar(value=False)
+        self.monitor_baud = tb.StringVar(value=str(DEFAULT_MONITOR_BAUD))
 
         self.create_widgets()
         self.detect_ports()
-        self.esptool_path = self.resource_path('esptool.exe')
 
+        # Device work (flashing, monitoring, port watching) runs off the Tk
+        # thread and reports back through one event queue. Phase timings of
+        # every flash are appended to telemetry.jsonl and serial output is
+        # kept under logs/, both in the data directory. Every flashed board's
+        # boot output is checked against boot_rules.json there, or the
+        # default crash markers. Every flash is recorded in history.sqlite3.
+        self.telemetry = Telemetry(open(data_path("telemetry.jsonl"), "a"), max_traces=0)
+        self.serial_logs = SerialLogStore(data_path("logs"))
+        self.boot_rules = self.load_boot_rules()
+        self.history = FlashHistory(data_path("history.sqlite3"))
+        self.orchestrator = DeviceOrchestrator(telemetry=self.telemetry,
+                                               logs=self.serial_logs,
+                                               boot_rules=self.boot_rules,
+                                               history=self.history).start()
+        self.package_errors = {}  # Package path -> why it was rejected
+        self.flash_port = None  # Port the progress bar follows
+        self.monitor_port = None  # Port shown in the serial monitor
 
-        self.total_size = 0
-        self.current_progress = 0
-        # Start a thread to continuously update ports
-        self.stop_port_update = False
-        threading.Thread(target=self.update_ports_periodically,
-                         daemon=True).start()
-
-        self.serial_monitor_active = False
         self.serial_monitor_visible = False
+        self.mac_address = None
         self.detect_ports()
         self.auto_select_port()  # Try to auto-select on startup
+        self.root.after(UI_FRAME_MS, self.process_events)
+
+    def load_boot_rules(self):
+        path = data_path("boot_rules.json")
+        if not os.path.exists(path):
+            return BootRules()
+        try:
+            return load_rules(path)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring {path}: {e}")
+            return BootRules()
 
     def get_os_name(self):
         return os.name
-    def resource_path(self, relative_path):
-        if hasattr(sys, '_MEIPASS'):
-            return os.path.join(sys._MEIPASS, relative_path)
-        return os.path.join(os.path.abspath("."), relative_path)
 
     def create_widgets(self):
         # Zip file selection
@@ -82,10 +107,21 @@ class ESP32Flasher:
         # Flash button
         tb.Button(button_frame, text="Flash ESP32", command=self.flash_firmware,
                   bootstyle="success").pack(side=LEFT, padx=5)
+        tb.Button(button_frame, text="Cancel", command=self.cancel_flash,
+                  bootstyle="outline-danger").pack(side=LEFT, padx=5)
         # tb.Button(button_frame, text="Show Serial Monitor", command=self.toggle_serial_monitor, bootstyle="info").pack(side=LEFT, padx=5)
         self.toggle_monitor_button = tb.Button(
             button_frame, text="Show Serial Monitor", command=self.toggle_serial_monitor, bootstyle="info")
         self.toggle_monitor_button.pack(side=LEFT, padx=5)
+        tb.Combobox(button_frame, textvariable=self.monitor_baud, width=8, state="readonly",
+                    values=[str(baud) for baud in MONITOR_BAUD_RATES]).pack(side=LEFT, padx=5)
+        # Differential flashing: skip regions the board already holds
+        tb.Checkbutton(button_frame, text="Only write changed regions", variable=self.diff_flash,
+                       bootstyle="round-toggle").pack(side=LEFT, padx=5)
+        tb.Checkbutton(button_frame, text="Verify after flashing", variable=self.verify_flash,
+                       bootstyle="round-toggle").pack(side=LEFT, padx=5)
+        tb.Checkbutton(button_frame, text="Auto flash on connect", variable=self.auto_flash,
+                       bootstyle="round-toggle").pack(side=LEFT, padx=5)
 
         # Status message
         self.status = tb.Label(self.root, text="", bootstyle="danger")
@@ -136,6 +172,10 @@ class ESP32Flasher:
             filetypes=[("ZIP Files", "*.zip")])
         if file_path:
             file_var.set(file_path)
+            # Checked and compressed in the background, so a bad package is
+            # reported now and a good one is ready before the board is
+            self.status.config(text="Checking firmware package...", bootstyle="info")
+            self.orchestrator.prefetch(file_path)
         print(f"File selected: {file_path}")
 
     def toggle_serial_monitor(self):
@@ -146,13 +186,10 @@ class ESP32Flasher:
             self.show_serial_monitor()
             
 
-    def detect_ports(self):
-        ports = serial.tools.list_ports.comports()
-        potential_ports = []
-        for port in ports:
-            if any(identifier in port.device.lower() or identifier in port.description.lower()
-                   for identifier in ['cp210x', 'ch340', 'ftdi', 'arduino', 'wchusbserial', 'usbserial']):
-                potential_ports.append(port.device)
+    def detect_ports(self, ports=None):
+        if ports is None:
+            ports = serial.tools.list_ports.comports()
+        potential_ports = [port.device for port in ports if is_mcu_port(port)]
 
         if potential_ports:
             if self.port.get() not in potential_ports:
@@ -164,10 +201,72 @@ class ESP32Flasher:
                 text="No MCU detected. Please select port manually.", bootstyle="warning")
             self.port_menu['values'] = [port.device for port in ports]
 
-    def update_ports_periodically(self):
-        while not self.stop_port_update:
-            self.detect_ports()
-            time.sleep(1)  # Check every second
+    def process_events(self):
+        # Runs on the Tk thread once per frame and applies everything the
+        # device tasks reported since. Rescheduled even when a handler fails,
+        # or no device event would reach the window again.
+        try:
+            self.apply_events()
+        finally:
+            self.root.after(UI_FRAME_MS, self.process_events)
+
+    def apply_events(self):
+        monitor_lines = []
+        while True:
+            try:
+                kind, port, data = self.orchestrator.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == MONITOR_LINES:
+                monitor_lines.append((port, data["lines"]))
+            elif kind == PORTS_CHANGED:
+                self.handle_port_change(data["added"], data["ports"])
+            elif kind == FLASH_PROGRESS and port == self.flash_port:
+                self.show_progress(data["snapshot"])
+            elif kind == FLASH_DONE:
+                self.flash_succeeded(port, data["mac"], data["verification"])
+            elif kind == FLASH_FAILED:
+                self.flash_failed(port, data["error_type"], data["message"])
+            elif kind == FLASH_CANCELLED and port == self.flash_port:
+                self.progress.grid_remove()
+                self.progress_label.grid_remove()
+                self.status.config(text="Flashing cancelled", bootstyle="warning")
+            elif kind == PACKAGE_READY:
+                self.package_ready(data)
+            elif kind == PACKAGE_FAILED:
+                self.package_failed(data["path"], data["message"])
+            elif kind == BOOT_CHECKED:
+                self.boot_checked(port, data["verdict"], data["reason"])
+            elif kind == MONITOR_STOPPED and port == self.monitor_port:
+                self.monitor_port = None
+        lines = [line for port, batch in monitor_lines if port == self.monitor_port for line in batch]
+        if lines:
+            self.update_serial_monitor(lines)
+
+    def package_ready(self, package):
+        self.package_errors.pop(package["path"], None)
+        if package["path"] == self.zip_file.get():
+            self.status.config(text=f"Package ready: {package['chip']}, {package['images']} images, "
+                                    f"{package['size'] / 1024:.0f} KB ({package['flash_size']} flash)",
+                               bootstyle="success")
+
+    def package_failed(self, path, message):
+        self.package_errors[path] = message
+        if path == self.zip_file.get():
+            self.status.config(text="Invalid firmware package", bootstyle="danger")
+            messagebox.showerror("Invalid firmware package", message)
+
+    def handle_port_change(self, added, ports):
+        self.detect_ports(ports)
+        if not self.auto_flash.get() or not self.zip_file.get():
+            return
+        if self.zip_file.get() in self.package_errors:
+            return
+        for port in added:
+            if is_mcu_port(port):
+                print(f"Board connected on {port.device}, flashing")
+                self.port.set(port.device)
+                self.flash_firmware()
 
     def flash_firmware(self):
         zip_file = self.zip_file.get()
@@ -177,143 +276,73 @@ class ESP32Flasher:
             messagebox.showerror(
                 "Error", "Please select the ZIP file and port.")
             return
+        if zip_file in self.package_errors:
+            messagebox.showerror("Invalid firmware package", self.package_errors[zip_file])
+            return
 
+        # The flash task stops the monitor on this port before connecting
+        if self.monitor_port == port:
+            self.monitor_port = None
+        self.flash_port = port
         self.status.config(text="")
+        self.progress_var.set(0)
+        self.progress_text.set("Connecting...")
         self.progress.grid()
         self.progress_label.grid()
 
-        # Start flashing process in a separate thread
-        threading.Thread(target=self.flash, args=(zip_file, port)).start()
+        print("OS: ",self.get_os_name())
+        print("Connecting...")
+        # One connection: flash, read the MAC, then keep the port open for the monitor
+        self.orchestrator.flash(port, zip_file, self.diff_flash.get(),
+                                monitor_baud=int(self.monitor_baud.get()),
+                                verify=self.verify_flash.get())
+
+    def boot_checked(self, port, verdict, reason):
+        if port != self.monitor_port:
+            print(f"Boot check on {port}: {verdict} ({reason})")
+            self.orchestrator.stop_monitor(port)
+            return
+        if verdict == PASS:
+            self.status.config(text=f"Boot check passed: {reason}", bootstyle="success")
+        else:
+            self.status.config(text=f"Boot check failed: {reason}", bootstyle="danger")
+
+    def cancel_flash(self):
+        if self.flash_port is not None:
+            self.orchestrator.cancel(self.flash_port)
+
+    def flash_succeeded(self, port, mac_address, verification=None):
+        if port != self.flash_port:
+            # Flashed alongside the board on screen; nobody watches its output
+            # beyond the boot check, which stops its monitor
+            print(f"Flashed {port}, MAC {mac_address}")
+            return
+        if verification:
+            self.status.config(text=f"Firmware flashed and verified ({len(verification)} regions)!",
+                               bootstyle="success")
+        else:
+            self.status.config(text="Firmware flashed successfully!", bootstyle="success")
+        self.show_mac_address(mac_address)
+        # The flash task already handed the open port to a monitor
+        self.clear_serial_monitor()
+        if self.monitor_port not in (None, port):
+            self.orchestrator.stop_monitor(self.monitor_port)
+        self.monitor_port = port
+        if not self.serial_monitor_visible:
+            self.serial_monitor.grid()
+            self.serial_monitor_visible = True
+            self.toggle_monitor_button.config(text="Hide Serial Monitor")
+
+    def flash_failed(self, port, error_type, error_message):
+        if port != self.flash_port:
+            print(f"{port}: {error_type}: {error_message}")
+            return
+        self.handle_error(error_type, error_message)
+
+    def show_progress(self, snapshot):
+        self.progress_var.set(snapshot["percent"])
+        self.progress_text.set(format_progress(snapshot))
 
-    def flash(self, zip_file, port):
-        try:
-            with serial.Serial(port) as ser:
-                ser.close()
-            print("Serial port opened successfully:", port)
-        except serial.SerialException as e:
-            self.handle_error("Serial error", str(e))
-            # Extract ZIP file
-        extract_path = os.path.join(os.path.dirname(zip_file), "extracted")
-        with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-            zip_ref.extractall(extract_path)
-        print("Extracted files to:", extract_path)
-
-        # Get the paths to the extracted files
-        bootloader = os.path.join(extract_path, "bootloader.bin")
-        firmware = os.path.join(extract_path, "firmware.bin")
-        partition = os.path.join(extract_path, "partitions.bin")
-        boot_app0 = os.path.join(extract_path, "boot_app0.bin")  # Optional
-
-        if self.get_os_name()=="nt":
-                # Build the esptool command
-            try:
-                cmd = [
-                    '--chip', 'esp32',
-                    '-p', port,
-                    '-b', '921600',
-                    '--before=default_reset',
-                    '--after=hard_reset',
-                    'write_flash',
-                    '-z',
-                    '--flash_mode', 'dio',
-                    '--flash_freq', '40m',
-                    '--flash_size', '4MB',
-                    '0x1000', bootloader,
-                    '0x8000', partition,
-                    '0x10000', firmware
-                ]
-                if os.path.exists(boot_app0):
-                    cmd.extend(['0xe000', boot_app0])
-
-                # Run esptool in a separate process
-                esptool_process = subprocess.Popen([self.esptool_path] + cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-
-                # Read and process output line by line
-                while True:
-                    output = esptool_process.stdout.readline()
-                    if not output:
-                        break
-                    print(output.strip())  # Print to console
-                    self.process_output(output.strip())
-
-                # Wait for the process to finish and get the return code
-                esptool_process.communicate()
-                return_code = esptool_process.returncode
-
-                if return_code == 0:
-                    self.update_progress(100)  # Complete progress
-                    self.status.config(text="Firmware flashed successfully!", bootstyle="success")
-                    self.get_mac_address(port,self.get_os_name())
-                    if not self.serial_monitor_visible:
-                        self.show_serial_monitor()
-                else:
-                    self.handle_error("Error", f"esptool returned non-zero exit code: {return_code}")
-
-            except serial.SerialException as e:
-                self.handle_error("Serial error", str(e))
-            except PermissionError as e:
-                self.handle_error("Permission error", f"{str(e)}.\nHint: Check if the port is used by another task.")
-            except Exception as e:
-                self.handle_error("Unknown error", str(e))
-        if self.get_os_name()!="nt":
-            print("OS: ",self.get_os_name())
-            try:
-                # Build the esptool command
-                cmd = [
-                    '--chip', 'esp32',
-                    '--port', port,
-                    '--baud', '921600',
-                    '--before', 'default_reset',
-                    '--after', 'hard_reset',
-                    'write_flash',
-                    '-z',
-                    '--flash_mode', 'dio',
-                    '--flash_freq', '40m',
-                    '--flash_size', '4MB',
-                    '0x1000', bootloader,
-                    '0x8000', partition,
-                    '0x10000', firmware
-                ]
-                if os.path.exists(boot_app0):
-                    cmd.extend(['0xe000', boot_app0])
-
-                self.flashing_complete = False
-                # Start a separate thread to update the progress bar
-                progress_thread = threading.Thread(target=self.update_progress_gradually)
-                progress_thread.start()
-                # Run esptool using the library
-                print("Connecting...")
-                esptool.main(cmd)
-                
-                # Wait for the progress thread to complete
-                # progress_thread.join()
-                self.flashing_complete = True
-                
-                success_message = "Firmware flashed successfully!"
-                self.status.config(text=success_message, bootstyle="success")
-                self.get_mac_address(port)
-                if not self.serial_monitor_visible:
-                    self.show_serial_monitor()
-
-            except esptool.FatalError as e:
-                self.handle_error("Fatal error", str(e))
-            except Exception as e:
-                self.handle_error("Unknown error", str(e))
-    def update_progress_gradually(self):
-        try:
-            while not self.flashing_complete:
-                for i in range(101):
-                    if self.flashing_complete:
-                        break
-                    self.progress_var.set(i)
-                    self.progress_text.set(f"{i}%")
-                    self.progress.update()
-                    time.sleep(0.4)  # Adjust the delay as needed
-            self.progress_var.set(100)
-            self.progress_text.set("100%")
-            self.progress.update()
-        except Exception as e:
-            print(f"Error updating progress bar: {str(e)}")
     def show_serial_monitor(self):
         self.serial_monitor.grid()
         self.serial_monitor_visible = True
@@ -334,40 +363,31 @@ class ESP32Flasher:
         self.stop_monitor_button.grid()
 
     def start_serial_monitor(self):
-        if not self.serial_monitor_active:
-            self.serial_monitor_active = True
-            self.serial_monitor.delete(1.0, tb.END)  # Clear previous content
-            threading.Thread(target=self.read_serial, daemon=True).start()
+        port = self.port.get()
+        if self.monitor_port is None and port and not self.orchestrator.busy(port):
+            self.clear_serial_monitor()
+            self.monitor_port = port
+            self.orchestrator.start_monitor(port, int(self.monitor_baud.get()))
 
     def stop_serial_monitor(self):
-        self.serial_monitor_active = False
         # Close the serial port
-        if hasattr(self, 'serial_port') and self.serial_port is not None:
-            self.serial_port.close()
-            self.serial_port = None
+        if self.monitor_port is not None:
+            self.orchestrator.stop_monitor(self.monitor_port)
+            self.monitor_port = None
 
+    def clear_serial_monitor(self):
+        self.serial_monitor.config(state='normal')
+        self.serial_monitor.delete(1.0, tb.END)
+        self.serial_monitor.config(state='disabled')
 
-    def read_serial(self):
-        try:
-            self.serial_port = serial.Serial(self.port.get(), 115200, timeout=1)
-            while self.serial_monitor_active:
-                if self.serial_port.in_waiting:
-                    line = self.serial_port.readline().decode('utf-8', errors='replace').strip()
-                    self.root.after(0, self.update_serial_monitor, line)
-        except Exception as e:
-            self.root.after(0, self.update_serial_monitor, f"Error: {str(e)}")
-        finally:
-            # Close the serial port when the monitor is stopped
-            if self.serial_port is not None:
-                try:
-                    self.serial_port.close()
-                except:
-                    print("Error closing serial port")
-                self.serial_port = None
-    def update_serial_monitor(self, line):
+    def update_serial_monitor(self, lines):
         # Temporarily enable editing
         self.serial_monitor.config(state='normal')
-        self.serial_monitor.insert(tb.END, line + '\n')
+        self.serial_monitor.insert(tb.END, '\n'.join(lines) + '\n')
+        # Keep the widget within the scrollback limit
+        line_count = int(self.serial_monitor.index('end-1c').split('.')[0])
+        if line_count > MAX_SCROLLBACK:
+            self.serial_monitor.delete(1.0, f"{line_count - MAX_SCROLLBACK}.0")
         self.serial_monitor.config(state='disabled')  # Make it read-only again
         self.serial_monitor.see(tb.END)  # Auto-scroll to the end
 
@@ -400,6 +420,7 @@ class ESP32Flasher:
 
     def copy_mac(self):
         if self.mac_address:
+            import pyperclip  # Only needed once a MAC is copied
             pyperclip.copy(self.mac_address)
             messagebox.showinfo(
                 "MAC Address Copied", f"The MAC address {self.mac_address} has been copied to the clipboard.")
@@ -407,95 +428,14 @@ class ESP32Flasher:
             messagebox.showwarning(
                 "No MAC Address", "No MAC address available to copy.")
 
-    def get_mac_address(self, port, os="POSIX"):
-        if(os=="nt"):
-            try:
-                cmd = [
-                    self.esptool_path,
-                    '--chip', 'esp32',
-                    '-p', port,
-                    '-b', '921600',
-                    'read_mac'
-                ]
-                if self.get_os_name()=='nt':
-                    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-                output, _ = process.communicate()
-                
-                mac_match = re.search(r'MAC:\s+([0-9A-Fa-f:]{17})', output)
-                if mac_match:
-                    self.mac_address = mac_match.group(1)
-                    self.mac_label.config(text=f"Device MAC Address: {self.mac_address.upper()}")
-                    self.mac_frame.grid()  # Show the MAC address frame
-                else:
-                    print("MAC address not found in the output")
-            except Exception as e:
-                print(f"Error getting MAC address: {str(e)}")
+    def show_mac_address(self, mac_address):
+        if mac_address:
+            self.mac_address = mac_address
+            self.mac_label.config(text=f"Device MAC Address: {self.mac_address.upper()}")
+            self.mac_frame.grid()  # Show the MAC address frame
         else:
-            try:
-                # Build the esptool command for reading the MAC address
-                cmd = [
-                    '--chip', 'esp32',
-                    '--port', port,
-                    '--baud', '921600',
-                    'read_mac'
-                ]
-
-                # Run esptool using the library and capture the output
-                output = io.StringIO()
-                sys.stdout = output
-                esptool.main(cmd)
-                sys.stdout = sys.__stdout__
-
-                # Process the output to extract the MAC address
-                output_str = output.getvalue()
-                mac_match = re.search(r'MAC:\s+([0-9A-Fa-f:]{17})', output_str)
-                if mac_match:
-                    self.mac_address = mac_match.group(1)
-                    self.mac_label.config(text=f"Device MAC Address: {self.mac_address}")
-                    self.mac_frame.grid()  # Show the MAC address frame
-                else:
-                    print("MAC address not found")
-            except Exception as e:
-                print(f"Error getting MAC address: {str(e)}")
-                
-            
-    
-    def process_output(self, output):
-        try:
-            if "Compressed" in output and "bytes to" in output:
-                size_start = output.find('Compressed') + 11
-                size_end = output.find('bytes')
-                if size_start > 0 and size_end > size_start:
-                    self.total_size += int(output[size_start:size_end].strip().replace(',', ''))
-            elif "Writing at" in output:
-                addr_start = output.find('0x')
-                addr_end = output.find('...', addr_start)
-                if addr_start > 0 and addr_end > addr_start:
-                    current_addr = int(output[addr_start:addr_end], 16)
-                    if current_addr in [0x1000, 0x8000]:
-                        # Skip the first 100% progress update for specific addresses
-                        if self.current_progress == 0:
-                            self.current_progress = 1
-                            self.total_size = current_addr
-                    else:
-                        self.update_progress(current_addr)
-                        self.consecutive_100 = 0  # Reset consecutive 100% count
-
-        except ValueError as e:
-            print(f"Unable to parse progress output: {output}")
-            print(f"Error: {str(e)}")
-
-    def update_progress(self, current_addr):
-        try:
-            if self.total_size > 0:
-                progress_percent = min(100, int((current_addr / self.total_size) * 100))
-                if progress_percent > self.current_progress:
-                    self.current_progress = progress_percent
-                    self.progress_var.set(self.current_progress)
-                    self.progress_text.set(f"{self.current_progress}%")
-                    self.progress.update()
-        except Exception as e:
-            print(f"Error updating progress bar: {str(e)}")
+            print("MAC address not found")
+
     def handle_error(self, error_type, error_message):
         self.progress.grid_remove()
         self.progress_label.grid_remove()
@@ -509,28 +449,14 @@ class ESP32Flasher:
         print("Error:", error_message)  # Detailed print
 
 
-def install(package):
-    subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-
 if __name__ == "__main__":
-    try:
-        import serial.tools.list_ports
-    except ImportError:
-        install('pyserial')
-
-    try:
-        import ttkbootstrap as tb
-    except ImportError:
-        install('ttkbootstrap')
-
-    try:
-        import esptool
-    except ImportError:
-        install('esptool')
-
+    # The windowed build has no console; keep esptool's output in a log
+    ensure_output_streams(data_path("flasher.log"))
     root = tb.Window(themename="cosmo")
     app = ESP32Flasher(root)
     root.mainloop()
-    # Stop the port update thread when closing the application
-    app.stop_port_update = True
+    # Stop the device tasks and the port watcher when closing the application
+    app.orchestrator.stop()
+    app.telemetry.sink.close()
+    app.serial_logs.close()
+    app.history.close()
@@ -0,0 +1,349 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+from baud_calibration import baud_for_port
+from boot_check import PASS
+from device_session import DeviceSession
+from firmware import PackageError, load_package
+from flash_history import CANCELLED, DIFF, FAILED, FLASH, SUCCESS, verified
+from flasher_core import FlashError
+from port_watcher import PortWatcher
+from progress import ProgressThrottle
+from serial_monitor import DEFAULT_MONITOR_BAUD, SerialMonitor
+from telemetry import COMPRESSION, MONITOR_START, span
+
+# Event kinds put on DeviceOrchestrator.events as (kind, port, data) tuples
+PORTS_CHANGED = "ports_changed"
+FLASH_STARTED = "flash_started"
+FLASH_PROGRESS = "flash_progress"
+FLASH_DONE = "flash_done"
+FLASH_FAILED = "flash_failed"
+FLASH_CANCELLED = "flash_cancelled"
+MONITOR_LINES = "monitor_lines"
+MONITOR_STOPPED = "monitor_stopped"
+BOOT_CHECKED = "boot_checked"
+PACKAGE_READY = "package_ready"
+PACKAGE_FAILED = "package_failed"
+
+MONITOR_INTERVAL = 0.033  # Seconds between serial monitor batches
+SHUTDOWN_TIMEOUT = 5.0
+
+
+class FlashCancelled(Exception):
+    pass
+
+
+class DeviceOrchestrator:
+    # Owns all device work for the GUI. An asyncio loop on one background
+    # thread runs a task per device operation (flash, monitor); blocking
+    # esptool and serial calls run in a thread pool. Results reach the UI only
+    # through the thread-safe `events` queue, so Tk is touched from its own
+    # thread alone and no state is shared between operations.
+    def __init__(self, max_devices=8, telemetry=None, logs=None, boot_rules=None, history=None):
+        self.events = queue.Queue()
+        # telemetry.Telemetry that gets a trace per flash, optional
+        self.telemetry = telemetry
+        # serial_log.SerialLogStore that monitored output is written to, optional
+        self.logs = logs
+        # boot_check.BootRules applied to the output after each flash; the
+        # verdict is emitted as BOOT_CHECKED as soon as it is known
+        self.boot_rules = boot_rules
+        # flash_history.FlashHistory every flash is recorded in, optional
+        self.history = history
+        self.port_watcher = None
+        # A flash and a monitor per device may each hold a worker
+        self._executor = ThreadPoolExecutor(max_workers=max_devices * 2,
+                                            thread_name_prefix="device")
+        self._loop = asyncio.new_event_loop()
+        self._thread = None
+        self._flashes = {}  # port -> (task, cancel event)
+        self._monitors = {}  # port -> (task, SerialMonitor)
+        self._macs = {}  # port -> MAC of the board last flashed there
+
+    def start(self, watch_ports=True):
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True,
+                                        name="orchestrator")
+        self._thread.start()
+        if watch_ports:
+            self.port_watcher = PortWatcher(self._on_ports_changed).start()
+        return self
+
+    def stop(self):
+        if self.port_watcher is not None:
+            self.port_watcher.stop()
+        if self._thread is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(SHUTDOWN_TIMEOUT)
+        except Exception as e:
+            print(f"Error stopping device tasks: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=1.0)
+        self._executor.shutdown(wait=False)
+        self._thread = None
+
+    # Thread-safe API; each call is handed over to the event loop
+
+    def flash(self, port, zip_file, diff=False, baud=None, monitor_baud=DEFAULT_MONITOR_BAUD,
+              verify=False):
+        # baud None means the port's calibrated rate; monitor_baud None
+        # resets the board without monitoring it afterwards
+        self._loop.call_soon_threadsafe(self._start_flash, port, zip_file, diff, baud, monitor_baud,
+                                        verify)
+
+    def prefetch(self, zip_file):
+        # Load, check and compress a package before any board needs it; the
+        # result is cached for the flashes that follow
+        self._loop.call_soon_threadsafe(self._start_prefetch, zip_file)
+
+    def cancel(self, port):
+        self._loop.call_soon_threadsafe(self._cancel_flash, port)
+
+    def start_monitor(self, port, baud=DEFAULT_MONITOR_BAUD):
+        self._loop.call_soon_threadsafe(self._start_monitor, port, baud)
+
+    def stop_monitor(self, port):
+        self._loop.call_soon_threadsafe(self._stop_monitor, port)
+
+    def busy(self, port):
+        return port in self._flashes
+
+    def emit(self, kind, port=None, **data):
+        self.events.put((kind, port, data))
+
+    def _on_ports_changed(self, added, removed, ports):
+        # Called from the watcher thread
+        self._loop.call_soon_threadsafe(self._ports_changed, added, removed, ports)
+
+    # Everything below runs on the event loop
+
+    def _ports_changed(self, added, removed, ports):
+        for info in removed:
+            # The board is gone, anything still talking to it can only fail
+            self._cancel_flash(info.device)
+            self._stop_monitor(info.device)
+            self._macs.pop(info.device, None)
+        self.emit(PORTS_CHANGED, added=added, removed=removed, ports=ports)
+
+    def _run(self, func, *args):
+        return self._loop.run_in_executor(self._executor, func, *args)
+
+    def _start_flash(self, port, zip_file, diff, baud, monitor_baud, verify):
+        if port in self._flashes:
+            print(f"{port} is already being flashed")
+            return
+        cancel = threading.Event()
+        task = self._loop.create_task(self._flash(port, zip_file, diff, baud, monitor_baud,
+                                                  verify, cancel))
+        self._flashes[port] = (task, cancel)
+        task.add_done_callback(lambda _: self._flashes.pop(port, None))
+
+    def _start_prefetch(self, zip_file):
+        self._loop.create_task(self._prefetch(zip_file))
+
+    async def _prefetch(self, zip_file):
+        try:
+            package = await self._run(load_package, zip_file)
+            await self._run(package.prefetch)
+        except PackageError as e:
+            self.emit(PACKAGE_FAILED, path=zip_file, message=str(e))
+        except OSError as e:
+            self.emit(PACKAGE_FAILED, path=zip_file, message=f"Cannot read {zip_file}: {e}")
+        except Exception as e:
+            # Whatever else goes wrong (esptool while preparing an image, ...)
+            # must not leave the UI waiting on the check
+            self.emit(PACKAGE_FAILED, path=zip_file, message=f"Cannot prepare {zip_file}: {e}")
+        else:
+            self.emit(PACKAGE_READY, path=zip_file, chip=package.chip, size=package.size,
+                      images=len(package.images), flash_size=package.flash_size)
+
+    def _cancel_flash(self, port):
+        if port in self._flashes:
+            # The worker notices at its next block and closes the port itself;
+            # the task ends when it has
+            self._flashes[port][1].set()
+
+    async def _flash(self, port, zip_file, diff, baud, monitor_baud, verify, cancel):
+        self.emit(FLASH_STARTED, port)
+        verification = []
+        trace = self.telemetry.trace(port) if self.telemetry else None
+        # What the history gets to know about this flash
+        session = {"started_at": time.time(), "diff": diff, "verification": verification}
+        # The flash session needs the port to itself
+        monitor_task = self._stop_monitor(port)
+        if monitor_task is not None:
+            await asyncio.wait([monitor_task])
+        try:
+            with span(trace, COMPRESSION):
+                session["package"] = package = await self._run(load_package, zip_file)
+            mac, serial_port, reset_at = await self._run(
+                self._flash_port, port, package, diff, baud, monitor_baud,
+                verification.extend if verify else None, cancel, trace, session)
+        except FlashCancelled:
+            self._flash_ended(FLASH_CANCELLED, port, trace, session)
+            return
+        except PackageError as e:
+            self._flash_ended(FLASH_FAILED, port, trace, session, error_type="Package error",
+                              message=str(e))
+            return
+        except FlashError as e:
+            self._flash_ended(FLASH_FAILED, port, trace, session, error_type="Fatal error",
+                              message=str(e), verification=verification)
+            return
+        except serial.SerialException as e:
+            self._flash_ended(FLASH_FAILED, port, trace, session, error_type="Serial error",
+                              message=str(e))
+            return
+        except PermissionError as e:
+            self._flash_ended(FLASH_FAILED, port, trace, session, error_type="Permission error",
+                              message=f"{e}.\nHint: Check if the port is used by another task.")
+            return
+        except Exception as e:
+            self._flash_ended(FLASH_FAILED, port, trace, session, error_type="Unknown error",
+                              message=str(e))
+            return
+        self._macs[port] = mac
+        session["mac"] = mac
+        checked = bool(monitor_baud and self.boot_rules and reset_at)
+        # With a boot check to come the session is recorded once it has a verdict
+        self._flash_ended(FLASH_DONE, port, None, session, record=not checked, mac=mac,
+                          verification=verification)
+        if monitor_baud:
+            # The trace is finished once the new firmware has said something
+            self._start_monitor(port, monitor_baud, serial_port, trace, reset_at,
+                                session if checked else None)
+        else:
+            self._finish_trace(trace, FLASH_DONE)
+
+    def _flash_ended(self, kind, port, trace, session, record=True, **data):
+        self._finish_trace(trace, kind)
+        if record:
+            result = {FLASH_DONE: SUCCESS, FLASH_FAILED: FAILED, FLASH_CANCELLED: CANCELLED}[kind]
+            self._record(port, session, result, data.get("message"))
+        self.emit(kind, port, **data)
+
+    def _boot_ended(self, port, session, check):
+        # A board that fails its boot check failed, as in FlashEngine
+        if check.verdict == PASS:
+            self._record(port, session, SUCCESS, boot=check.verdict)
+        else:
+            self._record(port, session, FAILED, f"Boot check failed: {check.reason}",
+                         boot=check.verdict)
+
+    def _record(self, port, session, result, error=None, boot=None):
+        if self.history is None:
+            return
+        package = session.get("package")
+        self.history.record(
+            mac=session.get("mac"), port=port,
+            package_sha256=package and package.sha256, package=package and package.path,
+            chip=package and package.chip, action=DIFF if session["diff"] else FLASH,
+            result=result, error=error, verified=verified(session["verification"]), boot=boot,
+            started_at=session["started_at"], duration=time.time() - session["started_at"])
+
+    def _finish_trace(self, trace, result):
+        if trace is not None:
+            self.telemetry.finish(trace, result)
+
+    def _flash_port(self, port, package, diff, baud, monitor_baud, on_verify, cancel, trace,
+                    session):
+        # Runs in a worker thread; returns (MAC, open port for the monitor or
+        # None, when the board was reset)
+        throttle = ProgressThrottle(lambda snapshot: self.emit(FLASH_PROGRESS, port, snapshot=snapshot))
+
+        def on_progress(progress):
+            if cancel.is_set():
+                raise FlashCancelled(f"Flashing {port} cancelled")
+            throttle(progress)
+
+        baud = baud or baud_for_port(port)
+        with DeviceSession(port, baud, package.chip, trace) as device:
+            session["mac"] = device.mac
+            device.flash(package, diff, on_progress, on_verify)
+            if cancel.is_set():
+                raise FlashCancelled(f"Flashing {port} cancelled")
+            if monitor_baud:
+                serial_port = device.handover(monitor_baud)
+                return device.mac, serial_port, device.reset_at
+            device.hard_reset()
+            return device.mac, None, device.reset_at
+
+    def _start_monitor(self, port, baud, serial_port=None, trace=None, reset_at=None,
+                       session=None):
+        # trace, reset_at and (for the history) session are given for the
+        # monitor that follows a flash
+        if port in self._monitors:
+            self._finish_trace(trace, FLASH_DONE)
+            if session is not None:
+                self._record(port, session, SUCCESS)
+            if serial_port is not None:
+                # Handed over by the flash; nobody else will close it
+                try:
+                    serial_port.close()
+                except Exception:
+                    print("Error closing serial port")
+            return
+        # Logged under the board's MAC when it is known, else under the port
+        log = self.logs.open(self._macs.get(port) or port) if self.logs else None
+        monitor = SerialMonitor(port, baud, serial_port=serial_port, log=log)
+        check = self.boot_rules.check(reset_at) if self.boot_rules and reset_at else None
+        task = self._loop.create_task(self._monitor(port, monitor, trace, reset_at, check,
+                                                    session))
+        self._monitors[port] = (task, monitor)
+
+    def _stop_monitor(self, port):
+        # Returns the monitor's task, for callers that need the port closed
+        if port not in self._monitors:
+            return None
+        task, monitor = self._monitors[port]
+        monitor.stop()
+        return task
+
+    async def _monitor(self, port, monitor, trace=None, reset_at=None, check=None, session=None):
+        reader = self._run(monitor.run)
+        try:
+            while not reader.done():
+                await asyncio.wait([reader], timeout=MONITOR_INTERVAL)
+                if trace is not None and monitor.first_data_at:
+                    trace.add(MONITOR_START, monitor.first_data_at - reset_at, reset_at)
+                    self._finish_trace(trace, FLASH_DONE)
+                    trace = None
+                lines = monitor.drain()
+                if lines:
+                    self.emit(MONITOR_LINES, port, lines=lines)
+                if check is not None and (check.feed(lines) or check.expire()):
+                    if session is not None:
+                        self._boot_ended(port, session, check)
+                    self.emit(BOOT_CHECKED, port, **check.to_dict())
+                    check = None
+        finally:
+            self._finish_trace(trace, FLASH_DONE)
+            monitor.stop()
+            await asyncio.wait([reader])
+            lines = monitor.drain()
+            if lines:
+                self.emit(MONITOR_LINES, port, lines=lines)
+            if check is not None and session is not None:
+                # Stopped before the boot check was decided; unless the last
+                # lines decide it, the boot was never confirmed
+                if check.feed(lines):
+                    self.emit(BOOT_CHECKED, port, **check.to_dict())
+                else:
+                    check.reason = "The monitor stopped before a verdict"
+                self._boot_ended(port, session, check)
+            self._monitors.pop(port, None)
+            self.emit(MONITOR_STOPPED, port, error=monitor.error)
+
+    async def _shutdown(self):
+        for port in list(self._flashes):
+            self._cancel_flash(port)
+        for port in list(self._monitors):
+            self._stop_monitor(port)
+        tasks = [task for task, _ in list(self._flashes.values()) + list(self._monitors.values())]
+        if tasks:
+            await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
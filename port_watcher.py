@@ -0,0 +1,89 @@
+import threading
+import time
+
+from serial.tools import list_ports
+
+try:
+    import pyudev  # Linux only, optional
+except ImportError:
+    pyudev = None
+
+MCU_IDENTIFIERS = ['cp210x', 'ch340', 'ftdi', 'arduino', 'wchusbserial', 'usbserial']
+
+
+def is_mcu_port(info):
+    return any(identifier in info.device.lower() or identifier in info.description.lower()
+               for identifier in MCU_IDENTIFIERS)
+
+
+class PortWatcher:
+    # Emits added/removed events for serial ports. With pyudev the tty
+    # subsystem's kernel notifications trigger a rescan; elsewhere the port
+    # set is polled and diffed. Either way a change is only reported once the
+    # port set has been stable for `debounce` seconds.
+    def __init__(self, on_change, poll_interval=1.0, debounce=0.25, use_udev=True):
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_udev = use_udev and pyudev is not None
+        self.ports = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self.ports = self.scan()
+        self._threads = [threading.Thread(target=self._watch, daemon=True)]
+        if self.use_udev:
+            try:
+                context = pyudev.Context()
+                self._monitor = pyudev.Monitor.from_netlink(context)
+                self._monitor.filter_by('tty')
+                self._monitor.start()
+                self._threads.append(threading.Thread(target=self._listen_udev, daemon=True))
+            except Exception as e:
+                print(f"udev unavailable, polling serial ports instead: {e}")
+                self.use_udev = False
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def scan(self):
+        return {info.device: info for info in list_ports.comports()}
+
+    def _listen_udev(self):
+        while not self._stop.is_set():
+            # Poll with a timeout so stop() is honoured
+            if self._monitor.poll(timeout=1.0) is not None:
+                self._wakeup.set()
+
+    def _watch(self):
+        # With udev the periodic scan is only a safety net
+        interval = self.poll_interval * 30 if self.use_udev else self.poll_interval
+        while not self._stop.is_set():
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                return
+            current = self.scan()
+            if current.keys() == self.ports.keys():
+                continue
+            # Let a burst of enumeration events settle before reporting
+            while True:
+                time.sleep(self.debounce)
+                settled = self.scan()
+                if settled.keys() == current.keys():
+                    break
+                current = settled
+            added = [current[device] for device in current.keys() - self.ports.keys()]
+            removed = [self.ports[device] for device in self.ports.keys() - current.keys()]
+            self.ports = current
+            if added or removed:
+                try:
+                    self.on_change(added, removed, list(current.values()))
+                except Exception as e:
+                    print(f"Error handling port change: {e}")
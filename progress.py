@@ -0,0 +1,95 @@
+import threading
+import time
+
+
+class FlashProgress:
+    # Bytes written to flash (uncompressed) and sent on the wire (compressed)
+    # for one device, fed by the write loop block by block
+    def __init__(self, port, total):
+        self.port = port
+        self.total = total
+        self.written = 0
+        self.sent = 0
+        self.region = None
+        self.offset = None
+        self.started_at = time.time()
+        self.finished = False
+
+    def start_region(self, name, offset):
+        self.region = name
+        self.offset = offset
+
+    def advance(self, written, sent):
+        self.written += written
+        self.sent += sent
+
+    def finish(self):
+        self.written = self.total
+        self.finished = True
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started_at
+
+    @property
+    def percent(self):
+        if self.total <= 0:
+            return 100 if self.finished else 0
+        return min(100, int(self.written * 100 / self.total))
+
+    @property
+    def bytes_per_second(self):
+        elapsed = self.elapsed
+        return self.written / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        rate = self.bytes_per_second
+        if self.finished:
+            return 0.0
+        if rate <= 0:
+            return None
+        return (self.total - self.written) / rate
+
+    def snapshot(self):
+        return {
+            "port": self.port,
+            "region": self.region,
+            "offset": self.offset,
+            "written": self.written,
+            "sent": self.sent,
+            "total": self.total,
+            "percent": self.percent,
+            "bytes_per_second": self.bytes_per_second,
+            "eta": self.eta,
+            "finished": self.finished,
+        }
+
+
+class ProgressThrottle:
+    # Passes at most one update per interval on to callback (plus the final
+    # one), so a fast write loop cannot flood the UI
+    def __init__(self, callback, interval=0.1):
+        self.callback = callback
+        self.interval = interval
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, progress):
+        now = time.monotonic()
+        with self._lock:
+            if not progress.finished and now - self._last < self.interval:
+                return
+            self._last = now
+        self.callback(progress.snapshot())
+
+
+def format_progress(snapshot):
+    text = f"{snapshot['percent']}%"
+    if snapshot["bytes_per_second"]:
+        text += f"  {snapshot['bytes_per_second'] / 1024:.1f} KiB/s"
+    if snapshot["eta"] is not None and not snapshot["finished"]:
+        text += f"  ETA {snapshot['eta']:.0f}s"
+    if snapshot["region"] and not snapshot["finished"]:
+        text += f"  ({snapshot['region']})"
+    return text
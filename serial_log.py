@@ -0,0 +1,308 @@
+import argparse
+import bisect
+import datetime
+import gzip
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+
+# Serial output of every board on disk, one directory per device (its MAC,
+# or the port when the MAC is unknown):
+#
+#   logs/246f28123456/20261018-101500-123456.log.gz
+#   logs/246f28123456/20261018-101500-123456.idx
+#   logs/246f28123456/20261018-131200-654321.log      (being written)
+#
+# Each line starts with the time it arrived. A segment is closed (and gzipped
+# in the background if asked to) once it reaches max_bytes, and only the
+# newest max_segments are kept. Next to every segment an index of
+# (time, byte offset) pairs, one per INDEX_INTERVAL bytes and one per monitor
+# session, lets readers seek straight to a point in time. Files are only open
+# during a monitor session; the next session appends to the same segment.
+
+DEFAULT_MAX_BYTES = 1024 * 1024
+DEFAULT_MAX_SEGMENTS = 10
+WRITE_BUFFER_SIZE = 64 * 1024
+FLUSH_INTERVAL = 1.0  # Seconds data may sit in the write buffer
+INDEX_INTERVAL = 16 * 1024  # Bytes between index entries
+INDEX_ENTRY = struct.Struct("<dQ")  # Time, offset into the uncompressed segment
+SEGMENT_TIME_FORMAT = "%Y%m%d-%H%M%S-%f"
+TIMESTAMP_LENGTH = 23  # "2026-10-18 10:15:00.123"
+
+
+def log_key(name):
+    # Directory name for a MAC ("24:6f:28:12:34:56") or a port
+    if re.fullmatch(r"([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}", name):
+        return name.replace(":", "").lower()
+    return re.sub(r"[^A-Za-z0-9.-]+", "_", name).strip("_")
+
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).isoformat(sep=" ", timespec="milliseconds")
+
+
+def parse_line(line):
+    # (time, text) of a logged line
+    stamp = datetime.datetime.fromisoformat(line[:TIMESTAMP_LENGTH])
+    return stamp.timestamp(), line[TIMESTAMP_LENGTH + 1:]
+
+
+class SerialLog:
+    # Writer for one device. Lines arrive from the monitor's reader thread and
+    # go through a large write buffer; nothing here waits on the disk per line.
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.directory = os.path.join(store.directory, key)
+        self._path = None  # Current segment, without extension
+        self._file = None
+        self._index = None
+        self._size = 0
+        self._indexed_at = 0
+        self._flushed_at = 0.0
+        self._new_session = True
+        self._lock = threading.Lock()
+
+    def write(self, lines, timestamp=None):
+        timestamp = timestamp or time.time()
+        prefix = format_time(timestamp) + " "
+        data = "".join(prefix + line + "\n" for line in lines).encode("utf-8", errors="replace")
+        with self._lock:
+            if self._file is None:
+                self._open_segment(timestamp)
+            if self._new_session or self._size - self._indexed_at >= INDEX_INTERVAL:
+                self._index.write(INDEX_ENTRY.pack(timestamp, self._size))
+                self._indexed_at = self._size
+                self._new_session = False
+            self._file.write(data)
+            self._size += len(data)
+            if self._size >= self.store.max_bytes:
+                self._close_segment()
+            elif timestamp - self._flushed_at >= FLUSH_INTERVAL:
+                self._flush(timestamp)
+
+    def close(self):
+        # End of a monitor session. The files are closed so idle devices hold
+        # no descriptors; the next session reopens the segment and appends.
+        try:
+            self.close_files()
+        finally:
+            self.store.release(self)
+
+    def close_files(self):
+        with self._lock:
+            self._new_session = True
+            if self._file is not None:
+                try:
+                    self._file.close()
+                finally:
+                    self._index.close()
+                    self._file = self._index = None
+
+    def _open_segment(self, timestamp):
+        os.makedirs(self.directory, exist_ok=True)
+        if self._path is None:
+            self._path = self._resumable_segment()
+        if self._path is None:
+            name = datetime.datetime.fromtimestamp(timestamp).strftime(SEGMENT_TIME_FORMAT)
+            self._path = os.path.join(self.directory, name)
+        self._file = open(self._path + ".log", "ab", buffering=WRITE_BUFFER_SIZE)
+        self._index = open(self._path + ".idx", "ab", buffering=WRITE_BUFFER_SIZE)
+        self._size = self._file.tell()
+        self._indexed_at = self._size
+        self._flushed_at = timestamp
+        self._new_session = True
+
+    def _resumable_segment(self):
+        # The newest segment, if it is still being written (e.g. by an
+        # earlier writer for this device)
+        segments = self.store.segments(self.key)
+        if segments:
+            path = segments[-1][0]
+            try:
+                if path.endswith(".log") and os.path.getsize(path) < self.store.max_bytes:
+                    return segment_base(path)
+            except OSError:
+                pass
+        return None
+
+    def _flush(self, timestamp):
+        self._file.flush()
+        self._index.flush()
+        self._flushed_at = timestamp
+
+    def _close_segment(self):
+        path = self._file.name
+        self._file.close()
+        self._index.close()
+        self._file = self._index = self._path = None
+        self.store.segment_closed(self.key, path)
+
+
+class SerialLogStore:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES,
+                 max_segments=DEFAULT_MAX_SEGMENTS, compress=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        self.compress = compress
+        self._logs = {}  # key -> [SerialLog, sessions using it]
+        self._lock = threading.Lock()
+
+    def open(self, name):
+        # The writer for a MAC or port; one per device, shared by the sessions
+        # that have it open and dropped once they have all closed it
+        key = log_key(name)
+        with self._lock:
+            if key not in self._logs:
+                self._logs[key] = [SerialLog(self, key), 0]
+            self._logs[key][1] += 1
+            return self._logs[key][0]
+
+    def release(self, log):
+        with self._lock:
+            entry = self._logs.get(log.key)
+            if entry is None or entry[0] is not log:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._logs[log.key]
+
+    def close(self):
+        with self._lock:
+            logs = [log for log, _ in self._logs.values()]
+            self._logs.clear()
+        for log in logs:
+            log.close_files()
+
+    def segment_closed(self, key, path):
+        if self.compress:
+            threading.Thread(target=self._compress, args=(key, path), daemon=True).start()
+        else:
+            self._prune(key)
+
+    def _compress(self, key, path):
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError as e:
+            print(f"Error compressing {path}: {e}")
+        self._prune(key)
+
+    def _prune(self, key):
+        segments = self.segments(key)
+        for path, _ in segments[:-self.max_segments]:
+            for name in (path, segment_base(path) + ".idx"):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    # Reading
+
+    def devices(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, name)))
+
+    def segments(self, name):
+        # [(path, start time)] of a device, oldest first
+        directory = os.path.join(self.directory, log_key(name))
+        if not os.path.isdir(directory):
+            return []
+        segments = []
+        for entry in os.listdir(directory):
+            if not entry.endswith((".log", ".log.gz")):
+                continue
+            path = os.path.join(directory, entry)
+            if entry.endswith(".gz") and os.path.exists(path[:-len(".gz")]):
+                continue  # Still being compressed, the .log is complete
+            try:
+                started = datetime.datetime.strptime(entry.split(".")[0], SEGMENT_TIME_FORMAT)
+            except ValueError:
+                continue
+            segments.append((path, started.timestamp()))
+        return sorted(segments, key=lambda segment: segment[1])
+
+    def read(self, name, since=None, until=None):
+        # Yields (time, line) of one device between two times
+        if since is not None:
+            # Lines carry milliseconds; compare at the same precision
+            since = parse_line(format_time(since) + " ")[0]
+        segments = self.segments(name)
+        for i, (path, started) in enumerate(segments):
+            ends = segments[i + 1][1] if i + 1 < len(segments) else None
+            if since is not None and ends is not None and ends < since:
+                continue
+            if until is not None and started > until:
+                return
+            with open_segment(path) as f:
+                if since is not None:
+                    f.seek(seek_offset(path, since))
+                for raw in f:
+                    timestamp, line = parse_line(raw.decode("utf-8", errors="replace").rstrip("\n"))
+                    if since is not None and timestamp < since:
+                        continue
+                    if until is not None and timestamp > until:
+                        return
+                    yield timestamp, line
+
+    def search(self, pattern, names=None, since=None, until=None):
+        # Yields (device, time, line) for lines matching a regex
+        regex = re.compile(pattern)
+        for name in names or self.devices():
+            for timestamp, line in self.read(name, since, until):
+                if regex.search(line):
+                    yield log_key(name), timestamp, line
+
+
+def segment_base(path):
+    return path[:-len(".log.gz")] if path.endswith(".gz") else path[:-len(".log")]
+
+
+def open_segment(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def read_index(path):
+    try:
+        with open(segment_base(path) + ".idx", "rb") as f:
+            data = f.read()
+    except OSError:
+        return []
+    usable = len(data) - len(data) % INDEX_ENTRY.size
+    return [INDEX_ENTRY.unpack_from(data, start) for start in range(0, usable, INDEX_ENTRY.size)]
+
+
+def seek_offset(path, timestamp):
+    # Offset of the last indexed point at or before `timestamp`
+    index = read_index(path)
+    position = bisect.bisect_right([entry[0] for entry in index], timestamp)
+    return index[position - 1][1] if position else 0
+
+
+def parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the serial logs of flashed boards")
+    parser.add_argument("directory", help="Log directory (logs/ in the flasher's data directory)")
+    parser.add_argument("pattern", nargs="?", default="", help="Regular expression, default every line")
+    parser.add_argument("--device", action="append", help="MAC or port, may be repeated")
+    parser.add_argument("--since", help="Epoch seconds or 'YYYY-MM-DD HH:MM:SS'")
+    parser.add_argument("--until", help="Epoch seconds or 'YYYY-MM-DD HH:MM:SS'")
+    args = parser.parse_args()
+    store = SerialLogStore(args.directory)
+    since = parse_time(args.since) if args.since else None
+    until = parse_time(args.until) if args.until else None
+    for device, timestamp, line in store.search(args.pattern, args.device, since, until):
+        print(f"{device} {format_time(timestamp)} {line}")
@@ -0,0 +1,138 @@
+import collections
+import threading
+import time
+
+import serial
+
+MONITOR_BAUD_RATES = [115200, 230400, 460800, 921600, 1500000, 2000000]
+DEFAULT_MONITOR_BAUD = 115200
+MAX_SCROLLBACK = 5000  # Lines
+READ_TIMEOUT = 0.05
+MAX_LINE_LENGTH = 4096
+RX_BUFFER_SIZE = 1 << 20
+# pyserial's socket:// in_waiting only says whether anything is readable, so
+# those ports read in chunks and let READ_TIMEOUT bound the wait
+SOCKET_READ_SIZE = 4096
+
+
+class SerialMonitor:
+    # Reads a serial port on a background thread. Reads block (with a short
+    # timeout) instead of polling in_waiting, so an idle port costs nothing.
+    # Decoded lines are queued for the consumer, which drains them in batches,
+    # and kept in a capped scrollback ring buffer. With a serial_log.SerialLog
+    # they are also written to disk from the reader thread.
+    def __init__(self, port, baud=DEFAULT_MONITOR_BAUD, max_lines=MAX_SCROLLBACK, serial_port=None,
+                 log=None):
+        self.port = port
+        self.baud = baud
+        self.scrollback = collections.deque(maxlen=max_lines)
+        self.serial_port = serial_port
+        self.log = log
+        self.error = None
+        self.bytes_received = 0
+        self.first_data_at = None
+        self.lines_received = 0
+        self._pending = []
+        self._partial = b''
+        self._lock = threading.Lock()
+        self._running = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    @property
+    def active(self):
+        return self._running and not self._stopped.is_set()
+
+    def drain(self):
+        # All lines received since the previous call
+        with self._lock:
+            lines, self._pending = self._pending, []
+        return lines
+
+    def _open(self):
+        ser = serial.serial_for_url(self.port, do_not_open=True)
+        ser.baudrate = self.baud
+        ser.timeout = READ_TIMEOUT
+        ser.open()
+        if hasattr(ser, 'set_buffer_size'):
+            # Windows only; the default driver buffer overflows at high rates
+            ser.set_buffer_size(rx_size=RX_BUFFER_SIZE)
+        return ser
+
+    def run(self):
+        # The blocking read loop; start() gives it a thread of its own, or an
+        # executor can run it directly. Returns once stop() is called.
+        try:
+            if self._stopped.is_set():
+                return
+            self._running = True
+            if self.serial_port is None:
+                self.serial_port = self._open()
+            else:
+                self.serial_port.timeout = READ_TIMEOUT
+            chunked = self.port.startswith("socket://")
+            while not self._stopped.is_set():
+                size = SOCKET_READ_SIZE if chunked else max(1, self.serial_port.in_waiting)
+                data = self.serial_port.read(size)
+                if data:
+                    if self.first_data_at is None:
+                        self.first_data_at = time.time()
+                    self.bytes_received += len(data)
+                    self._feed(data)
+                elif self._partial:
+                    # Line went quiet without a newline (e.g. a prompt)
+                    self._emit([self._partial])
+                    self._partial = b''
+        except Exception as e:
+            self.error = str(e)
+            self._emit([f"Error: {e}".encode()])
+        finally:
+            self._running = False
+            if self.log is not None:
+                self.log.close()
+            if self.serial_port is not None:
+                try:
+                    self.serial_port.close()
+                except Exception:
+                    print("Error closing serial port")
+                self.serial_port = None
+
+    def _feed(self, data):
+        chunks = (self._partial + data).split(b'\n')
+        self._partial = chunks.pop()
+        if len(self._partial) > MAX_LINE_LENGTH:
+            chunks.append(self._partial)
+            self._partial = b''
+        if chunks:
+            self._emit(chunks)
+
+    def _emit(self, chunks):
+        lines = [chunk.decode('utf-8', errors='replace').rstrip('\r') for chunk in chunks]
+        with self._lock:
+            self._pending.extend(lines)
+            if len(self._pending) > self.scrollback.maxlen:
+                # Consumer fell behind; older lines are beyond the scrollback anyway
+                del self._pending[:-self.scrollback.maxlen]
+            self.scrollback.extend(lines)
+            self.lines_received += len(lines)
+        if self.log is not None:
+            try:
+                self.log.write(lines)
+            except OSError as e:
+                print(f"Error writing the serial log, no longer logging {self.port}: {e}")
+                log, self.log = self.log, None
+                try:
+                    log.close()
+                except OSError:
+                    pass
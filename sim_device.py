@@ -0,0 +1,402 @@
+import argparse
+import functools
+import hashlib
+import operator
+import os
+import socket
+import struct
+import threading
+import time
+import zipfile
+import zlib
+
+from firmware_manifest import (BOOT_APP0_FILE, BOOTLOADER_FILE, FIRMWARE_FILE, IMAGE_MAGIC,
+                               PARTITION_ENTRY, PARTITION_MAGIC, PARTITIONS_FILE)
+
+# Serial-protocol stand-in for an ESP32 running the ROM loader and the
+# esptool flasher stub. It listens on a TCP port so esptool, pyserial and the
+# flasher can reach it through a socket://host:port URL. Run this file to
+# start some for the GUI or the CLI:
+#
+#   python sim_device.py --count 4 --boot-log boot.txt
+
+SLIP_END = b'\xc0'
+SLIP_ESC = b'\xdb'
+
+# Loader command opcodes
+SYNC = 0x08
+READ_REG = 0x0A
+WRITE_REG = 0x09
+MEM_BEGIN = 0x05
+MEM_END = 0x06
+MEM_DATA = 0x07
+FLASH_BEGIN = 0x02
+FLASH_DATA = 0x03
+FLASH_END = 0x04
+SPI_SET_PARAMS = 0x0B
+SPI_ATTACH = 0x0D
+CHANGE_BAUDRATE = 0x0F
+FLASH_DEFL_BEGIN = 0x10
+FLASH_DEFL_DATA = 0x11
+FLASH_DEFL_END = 0x12
+SPI_FLASH_MD5 = 0x13
+ERASE_FLASH = 0xD0
+ERASE_REGION = 0xD1
+READ_FLASH = 0xD2
+
+CHIP_DETECT_MAGIC_REG = 0x40001000
+ESP32_MAGIC = 0x00F01D83
+EFUSE_RD_REG_BASE = 0x3FF5A000
+RESET_IDLE = 0.2  # Seconds without loader traffic after a flash
+# Seconds from a port opening to the boot output of a board that resets then;
+# pyserial's socket:// drops anything already waiting when it opens
+OPEN_BOOT_DELAY = 0.1
+
+DEFAULT_BOOT_LOG = [
+    "ets Jun  8 2016 00:22:57",
+    "",
+    "rst:0x1 (POWERON_RESET),boot:0x13 (SPI_FAST_FLASH_BOOT)",
+    "configsip: 0, SPIWP:0xee",
+    "mode:DIO, clock div:2",
+    "load:0x3fff0030,len:1184",
+    "entry 0x400805f0",
+    "I (29) boot: ESP-IDF v4.4 2nd stage bootloader",
+    "I (512) app_start: Starting scheduler on PRO CPU.",
+    "Setup done",
+]
+
+
+# Partition table of an Arduino ESP32 4MB package: (type, subtype, offset, size, label)
+SIM_PARTITIONS = [
+    (0x01, 0x02, 0x9000, 0x5000, "nvs"),
+    (0x01, 0x00, 0xE000, 0x2000, "otadata"),
+    (0x00, 0x10, 0x10000, 0x140000, "app0"),
+    (0x00, 0x11, 0x150000, 0x140000, "app1"),
+    (0x01, 0x82, 0x290000, 0x160000, "spiffs"),
+]
+PARTITION_TABLE_SIZE = 0xC00
+
+
+def image(size, chip_id=0, digest=True):
+    # A well-formed ESP image (DIO, 40MHz, 4MB) of about `size` bytes: up to
+    # 16 segments, checksum and optionally the appended SHA-256 apps carry.
+    # The contents are half random and half padding, so they compress about
+    # as well as real code.
+    count = min(16, -(-size // 0x10000))
+    length = -(-size // count) + 3 & ~3
+    segments = b''
+    checksum = 0xEF
+    for index in range(count):
+        data = os.urandom(length // 2) + b'\x00' * (length - length // 2)
+        segments += struct.pack("<II", 0x3FFE0000 + index * length, length) + data
+        checksum ^= functools.reduce(operator.xor, data, 0)
+    header = bytes([IMAGE_MAGIC, count, 2, 0x20]) + struct.pack("<I", 0x40080000)
+    extended = bytes([0xEE, 0, 0, 0]) + struct.pack("<H", chip_id) + bytes(9) + bytes([digest])
+    body = header + extended + segments
+    body += b'\x00' * (15 - len(body) % 16) + bytes([checksum])
+    return body + hashlib.sha256(body).digest() if digest else body
+
+
+def partition_table():
+    table = b''.join(PARTITION_ENTRY.pack(PARTITION_MAGIC, type_, subtype, offset, size,
+                                          label.encode(), 0)
+                     for type_, subtype, offset, size, label in SIM_PARTITIONS)
+    return table + b'\xff' * (PARTITION_TABLE_SIZE - len(table))
+
+
+def write_package(path, app_size=1024 * 1024):
+    # An Arduino-style ESP32 package the flasher accepts, for benchmarks
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr(BOOTLOADER_FILE, image(20 * 1024, digest=False))
+        z.writestr(PARTITIONS_FILE, partition_table())
+        z.writestr(FIRMWARE_FILE, image(app_size))
+        z.writestr(BOOT_APP0_FILE, b'\xff' * 0x2000)
+    return path
+
+
+def slip_encode(packet):
+    return SLIP_END + packet.replace(b'\xdb', b'\xdb\xdd').replace(b'\xc0', b'\xdb\xdc') + SLIP_END
+
+
+class SlipReader:
+    def __init__(self, conn):
+        self.conn = conn
+        self.buffer = b''
+
+    def read_frame(self):
+        while True:
+            start = self.buffer.find(SLIP_END)
+            if start != -1:
+                end = self.buffer.find(SLIP_END, start + 1)
+                if end != -1:
+                    frame = self.buffer[start + 1:end]
+                    self.buffer = self.buffer[end:]
+                    if not frame:
+                        # Back-to-back delimiters, the second one opens the next frame
+                        continue
+                    return frame.replace(b'\xdb\xdc', b'\xc0').replace(b'\xdb\xdd', b'\xdb')
+            data = self.conn.recv(65536)
+            if not data:
+                return None
+            self.buffer += data
+
+
+class SimulatedESP32:
+    def __init__(self, mac="24:6f:28:12:34:56", flash_size=4 * 1024 * 1024,
+                 boot_log=None, boot_log_repeat=0, line_interval=0.0,
+                 wire_speed=True, flash_write_rate=None, host="127.0.0.1", port=0):
+        self.mac = bytes(int(part, 16) for part in mac.split(":"))
+        self.flash = bytearray(b'\xff' * flash_size)
+        self.boot_log = DEFAULT_BOOT_LOG if boot_log is None else boot_log
+        self.boot_log_repeat = boot_log_repeat
+        self.line_interval = line_interval
+        # Model the time a real UART link and flash chip would take
+        self.wire_speed = wire_speed
+        self.flash_write_rate = flash_write_rate
+        self.host = host
+        self.port = port
+        self.stats = {"connections": 0, "bytes_received": 0, "bytes_written": 0, "md5": 0}
+        self.pending_boot = False
+        self._server = None
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"socket://{self.host}:{self.port}"
+
+    def start(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((self.host, self.port))
+        self._server.listen(4)
+        self.port = self._server.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._server is not None:
+            try:
+                self._server.close()
+            except OSError:
+                pass
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset(self):
+        # Boot into the app: the next connection gets the boot log
+        self.pending_boot = True
+
+    def _serve(self):
+        while self._running:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.stats["connections"] += 1
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        session = _LoaderSession(self, conn)
+        try:
+            if self.pending_boot:
+                # The port was closed after a flash, which is when the board resets
+                time.sleep(OPEN_BOOT_DELAY)
+                session.emit_boot_log()
+            session.run()
+        except OSError:
+            pass
+        finally:
+            if session.flashed:
+                # Closed right after a flash, the board boots on the next open
+                self.pending_boot = True
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def md5(self, offset, size):
+        return hashlib.md5(bytes(self.flash[offset:offset + size])).digest()
+
+    def write(self, offset, data):
+        with self._lock:
+            self.flash[offset:offset + len(data)] = data
+            self.stats["bytes_written"] += len(data)
+        if self.flash_write_rate:
+            time.sleep(len(data) / self.flash_write_rate)
+
+    def erase(self, offset, size):
+        with self._lock:
+            self.flash[offset:offset + size] = b'\xff' * size
+
+    def read_reg(self, addr):
+        if addr == CHIP_DETECT_MAGIC_REG:
+            return ESP32_MAGIC
+        if addr == EFUSE_RD_REG_BASE + 4:
+            return struct.unpack(">I", self.mac[2:6])[0]
+        if addr == EFUSE_RD_REG_BASE + 8:
+            return struct.unpack(">H", self.mac[0:2])[0]
+        return 0
+
+
+class _LoaderSession:
+    def __init__(self, device, conn):
+        self.device = device
+        self.conn = conn
+        self.reader = SlipReader(conn)
+        self.stub = False
+        self.baud = 115200
+        self.flashed = False
+        self.deflate = None
+        self.write_offset = 0
+
+    def emit_boot_log(self):
+        device = self.device
+        lines = list(device.boot_log) * (device.boot_log_repeat + 1)
+        for line in lines:
+            self.conn.sendall(line.encode() + b"\r\n")
+            if device.line_interval:
+                time.sleep(device.line_interval)
+        device.pending_boot = False
+
+    def run(self):
+        while True:
+            # A flashed board that goes quiet has been reset into its app
+            self.conn.settimeout(RESET_IDLE if self.flashed else None)
+            try:
+                frame = self.reader.read_frame()
+            except socket.timeout:
+                self.conn.settimeout(None)
+                self.flashed = False
+                self.stub = False
+                self.emit_boot_log()
+                continue
+            if frame is None:
+                return
+            self.device.stats["bytes_received"] += len(frame)
+            if self.device.wire_speed:
+                # 10 bits per byte on the wire
+                time.sleep(len(frame) * 10.0 / self.baud)
+            if len(frame) < 8 or frame[0] != 0x00:
+                continue
+            _, op, size, _ = struct.unpack("<BBHI", frame[:8])
+            self.dispatch(op, frame[8:8 + size])
+
+    def reply(self, op, val=0, data=b"", error=0):
+        # The ESP32 ROM sends 4 status bytes, the stub sends 2
+        status = bytes([1 if error else 0, error]) + (b"" if self.stub else b"\x00\x00")
+        payload = data + status
+        self.conn.sendall(slip_encode(struct.pack("<BBHI", 1, op, len(payload), val) + payload))
+
+    def dispatch(self, op, data):
+        device = self.device
+        if op == SYNC:
+            val = 0 if self.stub else 0x20120707
+            for _ in range(8):
+                self.reply(op, val)
+        elif op == READ_REG:
+            self.reply(op, device.read_reg(struct.unpack("<I", data[:4])[0]))
+        elif op in (WRITE_REG, SPI_SET_PARAMS, SPI_ATTACH, MEM_BEGIN, MEM_DATA, FLASH_END):
+            self.reply(op)
+        elif op == MEM_END:
+            self.reply(op)
+            self.stub = True
+            self.conn.sendall(slip_encode(b"OHAI"))
+        elif op == CHANGE_BAUDRATE:
+            self.reply(op)
+            self.baud = struct.unpack("<I", data[:4])[0] or self.baud
+        elif op == FLASH_BEGIN:
+            size, _, _, offset = struct.unpack("<IIII", data[:16])
+            self.write_offset = offset
+            if size:
+                device.erase(offset, size)
+            self.reply(op)
+        elif op == FLASH_DATA:
+            length = struct.unpack("<I", data[:4])[0]
+            device.write(self.write_offset, data[16:16 + length])
+            self.write_offset += length
+            self.flashed = True
+            self.reply(op)
+        elif op == FLASH_DEFL_BEGIN:
+            _, _, _, offset = struct.unpack("<IIII", data[:16])
+            self.write_offset = offset
+            self.deflate = zlib.decompressobj()
+            self.reply(op)
+        elif op == FLASH_DEFL_DATA:
+            length = struct.unpack("<I", data[:4])[0]
+            if self.deflate is None:
+                self.reply(op, error=0xC3)
+                return
+            chunk = self.deflate.decompress(data[16:16 + length])
+            device.write(self.write_offset, chunk)
+            self.write_offset += len(chunk)
+            self.flashed = True
+            self.reply(op)
+        elif op == FLASH_DEFL_END:
+            self.deflate = None
+            self.reply(op)
+        elif op == SPI_FLASH_MD5:
+            offset, size = struct.unpack("<II", data[:8])
+            device.stats["md5"] += 1
+            digest = device.md5(offset, size)
+            self.reply(op, data=digest if self.stub else digest.hex().encode())
+        elif op == ERASE_FLASH:
+            device.erase(0, len(device.flash))
+            self.reply(op)
+        elif op == ERASE_REGION:
+            offset, size = struct.unpack("<II", data[:8])
+            device.erase(offset, size)
+            self.reply(op)
+        elif op == READ_FLASH and self.stub:
+            self.read_flash(*struct.unpack("<IIII", data[:16]))
+        else:
+            # Invalid command
+            self.reply(op, error=0x05)
+
+    def read_flash(self, offset, length, block_size, _max_inflight):
+        self.reply(READ_FLASH)
+        data = bytes(self.device.flash[offset:offset + length])
+        for start in range(0, length, block_size):
+            self.conn.sendall(slip_encode(data[start:start + block_size]))
+            self.reader.read_frame()  # Acknowledgement
+        self.conn.sendall(slip_encode(hashlib.md5(data).digest()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve simulated ESP32 boards over TCP")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0, help="First TCP port, 0 for any free one")
+    parser.add_argument("--boot-log", help="Text file the boards print after a reset")
+    parser.add_argument("--repeat", type=int, default=0, help="Extra copies of the boot log")
+    parser.add_argument("--line-interval", type=float, default=0.0,
+                        help="Seconds between boot log lines")
+    parser.add_argument("--no-wire-speed", action="store_true",
+                        help="Do not model UART transfer time")
+    args = parser.parse_args()
+    boot_log = None
+    if args.boot_log:
+        with open(args.boot_log) as f:
+            boot_log = f.read().splitlines()
+    devices = []
+    for index in range(args.count):
+        devices.append(SimulatedESP32(mac=f"24:6f:28:00:00:{index + 1:02x}", boot_log=boot_log,
+                                      boot_log_repeat=args.repeat, line_interval=args.line_interval,
+                                      wire_speed=not args.no_wire_speed,
+                                      port=args.port + index if args.port else 0).start())
+        print(devices[-1].url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for device in devices:
+            device.stop()
@@ -0,0 +1,194 @@
+import argparse
+import collections
+import contextlib
+import json
+import math
+import sys
+import threading
+import time
+
+# Per-device timing spans for flash sessions. A SessionTrace records how long
+# each phase of one session took; Telemetry collects the traces of a batch,
+# exports them as JSON lines or Prometheus text and summarizes them per phase.
+
+PORT_OPEN = "port_open"
+RESET_SYNC = "reset_sync"
+STUB = "stub"
+BAUD_CHANGE = "baud_change"
+MAC = "mac"
+COMPRESSION = "compression"  # Preparing the package (cached after the first load)
+DIFF = "diff"
+WRITE = "write"
+VERIFY = "verify"
+RESET = "reset"
+MONITOR_START = "monitor_start"  # Reset until the first byte from the new firmware
+PHASES = [PORT_OPEN, RESET_SYNC, STUB, BAUD_CHANGE, MAC, COMPRESSION, DIFF, WRITE, VERIFY,
+          RESET, MONITOR_START]
+
+QUANTILES = [0.5, 0.95]
+METRIC_PREFIX = "esp32flasher"
+MAX_TRACES = 10000  # Kept for summaries; the sink gets every one
+
+
+class SessionTrace:
+    def __init__(self, port, **labels):
+        self.port = port
+        self.labels = labels
+        self.spans = []
+        self.result = None
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, phase, **attrs):
+        start = time.time()
+        t = time.perf_counter()
+        try:
+            yield attrs  # The block may add attributes, e.g. bytes written
+        finally:
+            self.add(phase, time.perf_counter() - t, start, **attrs)
+
+    def add(self, phase, duration, start=None, **attrs):
+        with self._lock:
+            self.spans.append(dict(attrs, phase=phase, start=start or time.time() - duration,
+                                   duration=duration))
+
+    def totals(self):
+        totals = {}
+        for span in self.spans:
+            totals[span["phase"]] = totals.get(span["phase"], 0.0) + span["duration"]
+        return {phase: round(duration, 4) for phase, duration in totals.items()}
+
+    def to_dict(self):
+        return {
+            "port": self.port,
+            "labels": self.labels,
+            "result": self.result,
+            "started_at": self.started_at,
+            "spans": self.spans,
+            "totals": self.totals(),
+        }
+
+
+def span(trace, phase, **attrs):
+    # trace.span(), or nothing when the caller is not tracing
+    if trace is None:
+        return contextlib.nullcontext(attrs)
+    return trace.span(phase, **attrs)
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a non-empty list
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class Telemetry:
+    def __init__(self, sink=None, max_traces=MAX_TRACES):
+        # sink: open file that finished traces are appended to as JSON lines.
+        # Only the newest max_traces are kept for summaries (None for all,
+        # 0 for none when only the sink is wanted).
+        self.sink = sink
+        self.traces = collections.deque(maxlen=max_traces)
+        self._lock = threading.Lock()
+
+    def trace(self, port, **labels):
+        # port None traces batch work (preparing the package) rather than a
+        # flash session
+        trace = SessionTrace(port, **labels)
+        with self._lock:
+            self.traces.append(trace)
+        return trace
+
+    def finish(self, trace, result):
+        trace.result = result
+        if self.sink is not None:
+            with self._lock:
+                self.sink.write(json.dumps(trace.to_dict()) + "\n")
+                self.sink.flush()
+
+    def durations(self, key=None):
+        # {group: {phase: [seconds per session]}}, grouped by key(trace)
+        groups = {}
+        with self._lock:
+            traces = list(self.traces)
+        for trace in traces:
+            phases = groups.setdefault(key(trace) if key else None, {})
+            for phase, duration in trace.totals().items():
+                phases.setdefault(phase, []).append(duration)
+        return groups
+
+    def summary(self, by_port=False):
+        groups = self.durations((lambda trace: trace.port) if by_port else None)
+        return {group: summarize(phases) for group, phases in groups.items()}
+
+    def prometheus(self):
+        lines = [f"# HELP {METRIC_PREFIX}_phase_seconds Time spent per flash session phase",
+                 f"# TYPE {METRIC_PREFIX}_phase_seconds summary"]
+        for phase, durations in sorted_phases(self.durations().get(None, {})):
+            for quantile in QUANTILES:
+                lines.append(f'{METRIC_PREFIX}_phase_seconds{{phase="{phase}",quantile="{quantile}"}} '
+                             f'{percentile(durations, quantile):.6f}')
+            lines.append(f'{METRIC_PREFIX}_phase_seconds_sum{{phase="{phase}"}} {sum(durations):.6f}')
+            lines.append(f'{METRIC_PREFIX}_phase_seconds_count{{phase="{phase}"}} {len(durations)}')
+        results = {}
+        with self._lock:
+            sessions = [trace for trace in self.traces if trace.port is not None]
+        for trace in sessions:
+            results[trace.result] = results.get(trace.result, 0) + 1
+        lines.append(f"# HELP {METRIC_PREFIX}_sessions_total Flash sessions by result")
+        lines.append(f"# TYPE {METRIC_PREFIX}_sessions_total counter")
+        for result, count in sorted(results.items(), key=lambda item: str(item[0])):
+            lines.append(f'{METRIC_PREFIX}_sessions_total{{result="{result or "unknown"}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def sorted_phases(phases):
+    order = {phase: index for index, phase in enumerate(PHASES)}
+    return sorted(phases.items(), key=lambda item: (order.get(item[0], len(order)), item[0]))
+
+
+def summarize(phases):
+    return {phase: {"count": len(durations),
+                    "p50": round(percentile(durations, 0.5), 4),
+                    "p95": round(percentile(durations, 0.95), 4),
+                    "max": round(max(durations), 4)}
+            for phase, durations in sorted_phases(phases)}
+
+
+def format_summary(summary):
+    lines = []
+    for group, phases in summary.items():
+        if group is not None:
+            lines.append(str(group))
+        lines.append(f"{'phase':<14} {'count':>5} {'p50 s':>8} {'p95 s':>8} {'max s':>8}")
+        for phase, stats in phases.items():
+            lines.append(f"{phase:<14} {stats['count']:>5} {stats['p50']:>8.3f} "
+                         f"{stats['p95']:>8.3f} {stats['max']:>8.3f}")
+    return "\n".join(lines)
+
+
+def load_jsonl(paths):
+    telemetry = Telemetry(max_traces=None)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                trace = telemetry.trace(record["port"], **record.get("labels", {}))
+                trace.result = record.get("result")
+                trace.started_at = record.get("started_at", trace.started_at)
+                trace.spans = record["spans"]
+    return telemetry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize flash session timings")
+    parser.add_argument("traces", nargs="+", help="JSON lines files written by the flasher")
+    parser.add_argument("--by-port", action="store_true", help="One table per port/adapter")
+    parser.add_argument("--prometheus", action="store_true", help="Print Prometheus text instead")
+    args = parser.parse_args()
+    telemetry = load_jsonl(args.traces)
+    if args.prometheus:
+        sys.stdout.write(telemetry.prometheus())
+    else:
+        print(format_summary(telemetry.summary(args.by_port)))
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# The flasher's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim_device import SimulatedESP32, write_package  # noqa: E402
+
+APP_SIZE = 64 * 1024
+BAUD = 921600  # Given explicitly so no calibration profile is read
+
+
+@pytest.fixture
+def package(tmp_path):
+    return write_package(str(tmp_path / "fw.zip"), APP_SIZE)
+
+
+@pytest.fixture
+def sim():
+    # Without wire speed modelling, so flashing takes a fraction of a second
+    with SimulatedESP32(wire_speed=False) as device:
+        yield device
@@ -0,0 +1,41 @@
+import baud_calibration
+from baud_calibration import BaudProfiles, RateResult, best_result, calibrate
+
+
+def test_calibrates_simulated_board(sim, tmp_path):
+    profiles = BaudProfiles(str(tmp_path / "profiles.json"))
+    results = calibrate(sim.url, [115200, 460800], trials=2, profiles=profiles)
+    assert [(r.baud, r.trials, r.errors) for r in results] == [(115200, 2, 0), (460800, 2, 0)]
+    # Saved under the adapter and read back by the next run
+    assert BaudProfiles(profiles.path).get(sim.url) == best_result(results).baud
+
+
+def test_stops_at_the_first_unstable_rate(monkeypatch, tmp_path):
+    tried = []
+
+    def measure(port, baud, trials):
+        tried.append(baud)
+        result = RateResult(baud)
+        result.trials = trials
+        result.errors = int(baud > 460800)
+        result.bytes, result.seconds = baud, 1.0
+        return result
+
+    monkeypatch.setattr(baud_calibration, "measure_rate", measure)
+    profiles = BaudProfiles(str(tmp_path / "profiles.json"))
+    calibrate("loop://", [115200, 460800, 921600, 2000000], profiles=profiles)
+    assert tried == [115200, 460800, 921600]
+    assert profiles.get("loop://") == 460800
+
+
+def test_no_stable_rate():
+    failed = RateResult(115200)
+    failed.trials = failed.errors = 1
+    assert best_result([failed]) is None
+    assert best_result([]) is None
+
+
+def test_unreadable_profiles_are_ignored(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text("{not json")
+    assert BaudProfiles(str(path)).get("loop://") is None
@@ -0,0 +1,46 @@
+import pytest
+
+from boot_check import FAIL, PASS, BootRules
+
+
+def test_passes_once_everything_expected_is_seen():
+    check = BootRules(["WiFi connected", "Setup done"]).check(started_at=100.0)
+    assert check.feed(["boot", "Setup done"]) is None
+    assert check.feed(["WiFi connected", "Guru Meditation"]) == PASS
+    assert check.line == "WiFi connected"
+    # The verdict is final
+    assert check.feed(["Guru Meditation"]) == PASS
+
+
+def test_fails_on_forbidden_output():
+    check = BootRules(["Setup done"]).check()
+    assert check.feed(["rst:0x10 (RTCWDT_RTC_RESET)", "Setup done"]) == FAIL
+    assert check.reason == "'rst:0x10' in the boot output"
+
+
+def test_timeout():
+    check = BootRules(["Setup done"], timeout=5).check(started_at=100.0)
+    assert check.expire(now=104.9) is None
+    assert check.expire(now=105.0) == FAIL
+    assert "Setup done" in check.reason
+
+
+def test_nothing_expected_passes_at_timeout():
+    check = BootRules(timeout=5).check(started_at=100.0)
+    assert check.feed(["hello"]) is None
+    assert check.expire(now=106.0) == PASS
+
+
+def test_regex_markers():
+    check = BootRules([r"IP: \d+\.\d+\.\d+\.\d+"], forbidden=[r"E \(\d+\)"], regex=True).check()
+    assert check.feed(["IP: 10.0.0.7"]) == PASS
+    assert BootRules([], forbidden=[r"E \(\d+\)"], regex=True).check().feed(["E (42) wifi"]) == FAIL
+
+
+def test_rules_from_dict():
+    rules = BootRules.from_dict({"expected": ["ok"], "timeout": 3})
+    assert rules.to_dict()["timeout"] == 3
+    with pytest.raises(ValueError):
+        BootRules.from_dict({"expect": ["ok"]})
+    with pytest.raises(ValueError):
+        BootRules.from_dict({"expected": ["("], "regex": True})
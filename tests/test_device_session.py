@@ -0,0 +1,13 @@
+import sys
+
+from conftest import BAUD
+from device_session import flash_device
+from firmware import load_package
+
+
+def test_flashes_without_a_console(package, sim, monkeypatch):
+    # As in the windowed build (console=False), where esptool still flushes stdout
+    monkeypatch.setattr(sys, "stdout", None)
+    monkeypatch.setattr(sys, "stderr", None)
+    assert flash_device(sim.url, load_package(package), BAUD) == "24:6f:28:12:34:56"
+    assert sys.stdout is not None and sys.stderr is not None
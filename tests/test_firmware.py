@@ -0,0 +1,43 @@
+import shutil
+
+from firmware import PackageCache
+from sim_device import write_package
+
+
+def packages(tmp_path, count):
+    return [write_package(str(tmp_path / f"fw{n}.zip"), 32 * 1024) for n in range(count)]
+
+
+def test_cache_hits_by_content(tmp_path):
+    cache = PackageCache()
+    path, = packages(tmp_path, 1)
+    copy = str(tmp_path / "copy.zip")
+    shutil.copy(path, copy)
+    package = cache.get(path)
+    assert cache.get(copy) is package
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+    assert package.sha256 in cache
+    assert cache.size == package.cache_size
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    first, second, third = packages(tmp_path, 3)
+    size = PackageCache().get(first).cache_size
+    cache = PackageCache(max_size=size * 2 + size // 2)
+    a = cache.get(first)
+    b = cache.get(second)
+    cache.get(first)  # Now the most recently used
+    c = cache.get(third)
+    assert a.sha256 in cache and c.sha256 in cache
+    assert b.sha256 not in cache
+    assert cache.size == a.cache_size + c.cache_size
+
+
+def test_newest_package_is_kept_over_budget(tmp_path):
+    first, second = packages(tmp_path, 2)
+    cache = PackageCache(max_size=1)
+    cache.get(first)
+    package = cache.get(second)
+    assert len(cache) == 1 and package.sha256 in cache
+    cache.clear()
+    assert (len(cache), cache.size) == (0, 0)
@@ -0,0 +1,95 @@
+import hashlib
+import json
+
+import pytest
+
+from firmware import load_package
+from firmware_manifest import (PARTITION_ENTRY, PARTITION_MAGIC, PARTITION_MD5_MAGIC, PackageError,
+                               parse_partition_table, read_manifest, validate_manifest)
+from sim_device import image, partition_table
+
+FLASHER_ARGS = {
+    "flash_settings": {"flash_mode": "dio", "flash_freq": "40m", "flash_size": "4MB"},
+    "flash_files": {"0x1000": "bootloader/bootloader.bin",
+                    "0x8000": "partition_table/partition-table.bin",
+                    "0x10000": "app.bin"},
+    "extra_esptool_args": {"chip": "esp32"},
+}
+
+
+@pytest.fixture(scope="module")
+def idf_files():
+    # Members of an ESP-IDF build, without flasher_args.json
+    return {"build/bootloader/bootloader.bin": image(20 * 1024, digest=False),
+            "build/partition_table/partition-table.bin": partition_table(),
+            "build/app.bin": image(64 * 1024)}
+
+
+def with_args(files, args):
+    return dict(files, **{"build/flasher_args.json": json.dumps(args).encode()})
+
+
+def test_inferred_from_arduino_package(package):
+    loaded = load_package(package)
+    assert loaded.chip == "esp32"
+    assert (loaded.flash_mode, loaded.flash_freq, loaded.flash_size) == ("dio", "40m", "4MB")
+    assert [(i.offset, i.name) for i in loaded.images] == [
+        (0x1000, "bootloader.bin"), (0x8000, "partitions.bin"), (0xE000, "boot_app0.bin"),
+        (0x10000, "firmware.bin")]
+    assert loaded.manifest.source == "image headers"
+
+
+def test_idf_flasher_args(idf_files):
+    manifest = read_manifest(with_args(idf_files, FLASHER_ARGS))
+    validate_manifest(manifest, idf_files)
+    assert manifest.chip == "esp32"
+    assert manifest.images[-1] == (0x10000, "build/app.bin")
+
+
+@pytest.mark.parametrize("value", ["keep", "detect"])
+def test_flash_size_from_bootloader_header(idf_files, value):
+    args = dict(FLASHER_ARGS, flash_settings=dict(FLASHER_ARGS["flash_settings"], flash_size=value))
+    assert read_manifest(with_args(idf_files, args)).flash_size == "4MB"
+
+
+@pytest.mark.parametrize("change", [
+    {"flash_files": {"0x1000": 7}},
+    {"flash_settings": ["dio"]},
+    {"extra_esptool_args": "esp32"},
+    {"chip": 32},
+    {"flash_mode": 2},
+    {"flash_files": {"nowhere": "build/app.bin"}},
+])
+def test_malformed_flasher_args(idf_files, change):
+    with pytest.raises(PackageError):
+        read_manifest(with_args(idf_files, dict(FLASHER_ARGS, **change)))
+
+
+def test_partition_table():
+    partitions = parse_partition_table(partition_table())
+    assert [p["label"] for p in partitions] == ["nvs", "otadata", "app0", "app1", "spiffs"]
+    assert partitions[2]["offset"] == 0x10000
+
+
+def test_partition_table_md5():
+    entries = partition_table()[:3 * PARTITION_ENTRY.size]
+    md5_entry = PARTITION_MD5_MAGIC + b'\xff' * 14 + hashlib.md5(entries).digest()
+    assert len(parse_partition_table(entries + md5_entry)) == 3
+    corrupt = PARTITION_MD5_MAGIC + b'\xff' * 14 + hashlib.md5(b"other").digest()
+    with pytest.raises(PackageError, match="MD5"):
+        parse_partition_table(entries + corrupt)
+
+
+@pytest.mark.parametrize("offset, size", [(0, 0), (0x10000, 0), (0x1000, 0x1000)])
+def test_partition_table_rejects_impossible_entries(offset, size):
+    entry = PARTITION_ENTRY.pack(PARTITION_MAGIC, 0x00, 0x00, offset, size, b"app", 0)
+    with pytest.raises(PackageError):
+        parse_partition_table(entry)
+
+
+def test_corrupt_app_image(idf_files):
+    app = bytearray(idf_files["build/app.bin"])
+    app[100] ^= 0xFF
+    files = dict(idf_files, **{"build/app.bin": bytes(app)})
+    with pytest.raises(PackageError, match="corrupt"):
+        validate_manifest(read_manifest(with_args(files, FLASHER_ARGS)), files)
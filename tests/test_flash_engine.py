@@ -0,0 +1,157 @@
+import pytest
+
+from boot_check import BootRules
+from conftest import BAUD
+from firmware import DIFF_SEGMENT_SIZE, load_package
+from flash_engine import FAILED, FLASHING, RETRYING, SUCCESS, FlashEngine
+from flash_history import SKIP, FlashHistory
+from sim_device import SimulatedESP32
+
+
+def flashed_correctly(device, package):
+    return all(bytes(device.flash[image.offset:image.offset + image.size]) == image.data
+               for image in load_package(package).images)
+
+
+def test_flashes_simulated_boards(package):
+    devices = [SimulatedESP32(mac=f"24:6f:28:00:00:{n:02x}", wire_speed=False).start()
+               for n in range(1, 4)]
+    try:
+        engine = FlashEngine(package, [device.url for device in devices], max_workers=3,
+                             baud=BAUD, verify=True)
+        results = engine.run()
+    finally:
+        for device in devices:
+            device.stop()
+    assert [result.state for result in results] == [SUCCESS] * 3
+    assert [result.mac for result in results] == [f"24:6f:28:00:00:{n:02x}" for n in range(1, 4)]
+    assert all(result.verification for result in results)
+    assert all(flashed_correctly(device, package) for device in devices)
+    summary = engine.summary()
+    assert (summary["succeeded"], summary["failed"]) == (3, 0)
+    assert summary["boards_per_hour"] > 0
+
+
+def test_retries_then_succeeds(package):
+    calls = []
+    states = []
+
+    def flash(port, package, baud, **kwargs):
+        calls.append(port)
+        if len(calls) < 3:
+            raise OSError("port busy")
+        return "24:6f:28:12:34:56"
+
+    engine = FlashEngine(package, ["loop://"], retries=2, retry_delay=0, baud=BAUD,
+                         flash_func=flash, on_update=lambda result: states.append(result.state))
+    result, = engine.run()
+    assert (result.state, result.attempts, result.error) == (SUCCESS, 3, None)
+    assert states == [FLASHING, RETRYING, FLASHING, RETRYING, FLASHING, SUCCESS]
+
+
+def test_gives_up_after_retries(package):
+    def flash(port, package, baud, **kwargs):
+        raise OSError("no board")
+
+    result, = FlashEngine(package, ["loop://"], retries=1, retry_delay=0, baud=BAUD,
+                          flash_func=flash).run()
+    assert (result.state, result.attempts, result.error) == (FAILED, 2, "no board")
+
+
+def test_setup_errors_fail_the_board(package, monkeypatch):
+    def broken(port):
+        raise OSError("Not a directory")
+
+    monkeypatch.setattr("flash_engine.baud_for_port", broken)
+    result, = FlashEngine(package, ["loop://"], retries=0, flash_func=lambda *a, **k: None).run()
+    assert (result.state, result.error) == (FAILED, "Not a directory")
+
+
+def test_escaped_errors_fail_the_board(package):
+    def on_update(result):
+        if result.state == FLASHING:
+            raise RuntimeError("display gone")
+
+    result, = FlashEngine(package, ["loop://"], baud=BAUD, on_update=on_update,
+                          flash_func=lambda *a, **k: "24:6f:28:12:34:56").run()
+    assert (result.state, result.error) == (FAILED, "display gone")
+    assert result.finished_at is not None
+
+
+def test_reporting_errors_keep_the_outcome(package):
+    def on_update(result):
+        if result.state == SUCCESS:
+            raise RuntimeError("display gone")
+
+    result, = FlashEngine(package, ["loop://"], baud=BAUD, on_update=on_update,
+                          flash_func=lambda *a, **k: "24:6f:28:12:34:56").run()
+    assert result.state == SUCCESS
+    assert result.finished_at is not None
+
+
+def test_diff_flash_writes_only_changes(package, sim):
+    FlashEngine(package, [sim.url], baud=BAUD).run()
+    written = sim.stats["bytes_written"]
+    result, = FlashEngine(package, [sim.url], baud=BAUD, diff=True).run()
+    assert result.state == SUCCESS
+    assert sim.stats["bytes_written"] == written
+    # One changed segment is all that is written again
+    app = load_package(package).images[-1]
+    sim.write(app.offset + 5, bytes([sim.flash[app.offset + 5] ^ 0xFF]))
+    written = sim.stats["bytes_written"]
+    FlashEngine(package, [sim.url], baud=BAUD, diff=True).run()
+    assert 0 < sim.stats["bytes_written"] - written <= DIFF_SEGMENT_SIZE
+    assert flashed_correctly(sim, package)
+
+
+def test_boot_check(package, sim):
+    engine = FlashEngine(package, [sim.url], baud=BAUD, retries=0,
+                         boot_rules=BootRules(["Setup done"], timeout=10))
+    result, = engine.run()
+    assert result.state == SUCCESS
+    assert result.boot["verdict"] == "pass"
+    assert "Setup done" in result.output
+
+    failing = SimulatedESP32(wire_speed=False, boot_log=["Guru Meditation Error"]).start()
+    try:
+        result, = FlashEngine(package, [failing.url], baud=BAUD, retries=0,
+                              boot_rules=BootRules(["Setup done"])).run()
+    finally:
+        failing.stop()
+    assert result.state == FAILED
+    assert result.boot["verdict"] == "fail"
+
+
+def test_custom_flash_func_needs_capture_func(package):
+    with pytest.raises(ValueError):
+        FlashEngine(package, ["loop://"], monitor_seconds=1, flash_func=lambda *a, **k: None)
+    captured = []
+
+    def capture(port, package, baud, **kwargs):
+        captured.append(kwargs["seconds"])
+        return "24:6f:28:12:34:56", ["hello"], None
+
+    result, = FlashEngine(package, ["loop://"], baud=BAUD, monitor_seconds=2,
+                          flash_func=lambda *a, **k: None, capture_func=capture).run()
+    assert (result.state, result.output, captured) == (SUCCESS, ["hello"], [2])
+
+
+def test_history_skips_known_boards(package, sim, tmp_path):
+    history = FlashHistory(str(tmp_path / "history.sqlite3"))
+    FlashEngine(package, [sim.url], baud=BAUD, history=history).run()
+    written = sim.stats["bytes_written"]
+    result, = FlashEngine(package, [sim.url], baud=BAUD, history=history, known_boards=SKIP).run()
+    history.close()
+    assert (result.state, result.action) == (SUCCESS, SKIP)
+    assert sim.stats["bytes_written"] == written
+    assert [s["action"] for s in history.sessions(mac=result.mac)] == [SKIP, "flash"]
+
+
+def test_history_keeps_verification_apart_from_boot(package, tmp_path):
+    history = FlashHistory(str(tmp_path / "history.sqlite3"))
+    with SimulatedESP32(wire_speed=False, boot_log=["Guru Meditation Error"]) as sim:
+        result, = FlashEngine(package, [sim.url], baud=BAUD, retries=0, verify=True,
+                              boot_rules=BootRules(["Setup done"]), history=history).run()
+    history.close()
+    session, = history.sessions(mac=result.mac)
+    assert (session["result"], session["boot"], session["verified"]) == ("failed", "fail", 1)
@@ -0,0 +1,66 @@
+from flash_history import DIFF, FAILED, FLASH, SKIP, SUCCESS, FlashHistory, verified
+
+MAC = "24:6f:28:12:34:56"
+
+
+def test_sessions_are_written_in_batches(tmp_path):
+    history = FlashHistory(str(tmp_path / "history.sqlite3"), batch_size=10, flush_interval=60)
+    for n in range(25):
+        history.record(mac=f"24:6f:28:00:00:{n:02x}", package_sha256="abc", result=SUCCESS,
+                       started_at=1000.0 + n)
+    # Two full batches are written right away, the rest waits for the interval
+    history.close()
+    sessions = history.sessions(package_sha256="abc")
+    assert len(sessions) == 25
+    assert sessions[0]["started_at"] == 1024.0
+    assert history.counts("abc") == {SUCCESS: 25}
+
+
+def test_flush(tmp_path):
+    # flush() returns once the batch is written, at most one interval later
+    history = FlashHistory(str(tmp_path / "history.sqlite3"), flush_interval=0.1)
+    history.record(mac=MAC, package_sha256="abc", result=FAILED, error="boom")
+    history.flush()
+    assert history.last(MAC, result=FAILED)["error"] == "boom"
+    history.close()
+
+
+def test_known_board_action(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    history = FlashHistory(path)
+    history.record(mac=MAC, package_sha256="abc", result=SUCCESS)
+    history.record(mac="24:6f:28:00:00:01", package_sha256="abc", result=FAILED)
+    # Seen before the batch is written
+    assert history.known_board_action(MAC, "abc", SKIP) == SKIP
+    assert history.known_board_action(MAC, "abc", FLASH) == FLASH
+    assert history.known_board_action(MAC, "def", DIFF) == FLASH
+    assert history.known_board_action("24:6f:28:00:00:01", "abc", DIFF) == FLASH
+    assert history.known_board_action(None, "abc", SKIP) == FLASH
+    history.close()
+    # and by another process once it is
+    assert FlashHistory(path).known_board_action(MAC, "abc", DIFF) == DIFF
+
+
+def test_only_the_latest_session_counts(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    history = FlashHistory(path)
+    history.record(mac=MAC, package_sha256="A", result=SUCCESS, started_at=1000.0)
+    history.record(mac=MAC, package_sha256="B", result=SUCCESS, started_at=1001.0)
+    # The board runs B now and needs A written again
+    assert history.known_board_action(MAC, "A", SKIP) == FLASH
+    assert history.known_board_action(MAC, "B", SKIP) == SKIP
+    # A failed session may have left anything on the board
+    history.record(mac=MAC, package_sha256="B", result=FAILED, started_at=1002.0)
+    assert history.known_board_action(MAC, "B", SKIP) == FLASH
+    history.record(mac=MAC, package_sha256="A", result=SUCCESS, started_at=1003.0)
+    history.close()
+    reopened = FlashHistory(path)
+    assert reopened.known_board_action(MAC, "A", SKIP) == SKIP
+    assert reopened.known_board_action(MAC, "B", SKIP) == FLASH
+
+
+def test_verified():
+    assert verified(None) is None
+    assert verified([]) is None
+    assert verified([{"ok": True}, {"ok": True}]) == 1
+    assert verified([{"ok": True}, {"ok": False}]) == 0
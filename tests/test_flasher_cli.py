@@ -0,0 +1,36 @@
+import json
+
+from conftest import BAUD
+from flasher_cli import EXIT_FAILED, EXIT_JOB_ERROR, EXIT_OK, main
+from sim_device import SimulatedESP32
+
+
+def run(tmp_path, *args):
+    output = tmp_path / "results.jsonl"
+    code = main([*args, "--output", str(output)])
+    return code, [json.loads(line) for line in output.read_text().splitlines()]
+
+
+def test_flash_job(package, sim, tmp_path):
+    code, records = run(tmp_path, "--package", package, "--ports", sim.url, "--baud", str(BAUD),
+                        "--expect", "Setup done")
+    assert code == EXIT_OK
+    device, summary = records
+    assert (device["type"], device["state"], device["boot"]["verdict"]) == ("device", "success", "pass")
+    assert (summary["type"], summary["succeeded"], summary["total"]) == ("summary", 1, 1)
+
+
+def test_failed_board_fails_the_job(package, tmp_path):
+    with SimulatedESP32(wire_speed=False, boot_log=["Guru Meditation Error"]) as sim:
+        code, records = run(tmp_path, "--package", package, "--ports", sim.url,
+                            "--baud", str(BAUD), "--retries", "0", "--expect", "Setup done")
+    assert code == EXIT_FAILED
+    assert records[-1]["failed"] == 1
+
+
+def test_bad_package_is_a_job_error(tmp_path):
+    bad = tmp_path / "bad.zip"
+    bad.write_bytes(b"not a zip")
+    code, records = run(tmp_path, "--package", str(bad), "--ports", "socket://127.0.0.1:1")
+    assert code == EXIT_JOB_ERROR
+    assert records == [{"type": "error", "error": "Invalid firmware package: File is not a zip file"}]
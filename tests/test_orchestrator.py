@@ -0,0 +1,108 @@
+import queue
+import time
+
+import pytest
+import serial
+
+from boot_check import BootRules
+from conftest import BAUD
+from flash_history import FlashHistory
+from orchestrator import (BOOT_CHECKED, FLASH_CANCELLED, FLASH_DONE, FLASH_FAILED, FLASH_PROGRESS, FLASH_STARTED,
+                          MONITOR_LINES, MONITOR_STOPPED, PACKAGE_FAILED, PACKAGE_READY,
+                          DeviceOrchestrator)
+from sim_device import SimulatedESP32
+
+
+@pytest.fixture
+def orchestrator():
+    orchestrator = DeviceOrchestrator(max_devices=2).start(watch_ports=False)
+    yield orchestrator
+    orchestrator.stop()
+
+
+def events_until(orchestrator, kinds, timeout=30.0):
+    # Every event up to and including the first of `kinds`
+    events = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            event = orchestrator.events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        events.append(event)
+        if event[0] in kinds:
+            return events
+    raise AssertionError(f"No {kinds} in {[event[0] for event in events]}")
+
+
+def test_flash_then_monitor(orchestrator, package, sim):
+    orchestrator.flash(sim.url, package, baud=BAUD)
+    events = events_until(orchestrator, [FLASH_DONE, FLASH_FAILED])
+    kinds = [kind for kind, _, _ in events]
+    assert kinds[0] == FLASH_STARTED and FLASH_PROGRESS in kinds and kinds[-1] == FLASH_DONE
+    assert events[-1][2]["mac"] == "24:6f:28:12:34:56"
+    # The flash hands the open port to the monitor, which reads the boot log
+    lines = []
+    while "Setup done" not in lines:
+        lines += events_until(orchestrator, [MONITOR_LINES])[-1][2]["lines"]
+    assert orchestrator.busy(sim.url) is False
+    orchestrator.stop_monitor(sim.url)
+    assert events_until(orchestrator, [MONITOR_STOPPED])[-1][2]["error"] is None
+
+
+def test_flash_failure_is_reported(orchestrator, package):
+    with SimulatedESP32() as gone:
+        url = gone.url
+    orchestrator.flash(url, package, baud=BAUD, monitor_baud=None)
+    kind, port, data = events_until(orchestrator, [FLASH_DONE, FLASH_FAILED])[-1]
+    assert (kind, port) == (FLASH_FAILED, url)
+
+
+def test_cancel(orchestrator, package):
+    # Wire speed makes the write take long enough to cancel it
+    with SimulatedESP32() as sim:
+        orchestrator.flash(sim.url, package, baud=115200, monitor_baud=None)
+        events_until(orchestrator, [FLASH_PROGRESS])
+        orchestrator.cancel(sim.url)
+        kind = events_until(orchestrator, [FLASH_DONE, FLASH_FAILED, FLASH_CANCELLED])[-1][0]
+    assert kind == FLASH_CANCELLED
+
+
+def test_prefetch(orchestrator, package, tmp_path):
+    orchestrator.prefetch(package)
+    kind, _, data = events_until(orchestrator, [PACKAGE_READY, PACKAGE_FAILED])[-1]
+    assert (kind, data["chip"], data["images"]) == (PACKAGE_READY, "esp32", 4)
+    bad = tmp_path / "bad.zip"
+    bad.write_bytes(b"not a zip")
+    orchestrator.prefetch(str(bad))
+    kind, _, data = events_until(orchestrator, [PACKAGE_READY, PACKAGE_FAILED])[-1]
+    assert (kind, data["path"]) == (PACKAGE_FAILED, str(bad))
+
+
+def test_handed_over_port_is_closed_when_already_monitored(orchestrator):
+    orchestrator._monitors["loop://"] = (None, None)
+    serial_port = serial.serial_for_url("loop://")
+    orchestrator._start_monitor("loop://", 115200, serial_port)
+    assert not serial_port.is_open
+
+
+def test_session_is_recorded_with_its_boot_verdict(package, tmp_path):
+    history = FlashHistory(str(tmp_path / "history.sqlite3"))
+    orchestrator = DeviceOrchestrator(boot_rules=BootRules(["Setup done"], timeout=10),
+                                      history=history).start(watch_ports=False)
+    try:
+        with SimulatedESP32(wire_speed=False, boot_log=["Guru Meditation Error"]) as sim:
+            orchestrator.flash(sim.url, package, baud=BAUD, verify=True)
+            events_until(orchestrator, [FLASH_DONE, FLASH_FAILED])
+            # Nothing is recorded until the boot check has its verdict
+            history.flush()
+            assert history.sessions() == []
+            assert events_until(orchestrator, [BOOT_CHECKED])[-1][2]["verdict"] == "fail"
+            orchestrator.stop_monitor(sim.url)
+            events_until(orchestrator, [MONITOR_STOPPED])
+    finally:
+        orchestrator.stop()
+        history.close()
+    session, = history.sessions()
+    assert (session["result"], session["boot"], session["verified"]) == ("failed", "fail", 1)
+    assert session["mac"] == "24:6f:28:12:34:56"
@@ -0,0 +1,60 @@
+import threading
+import types
+
+from port_watcher import PortWatcher, is_mcu_port
+
+
+def port(device, description="n/a"):
+    return types.SimpleNamespace(device=device, description=description)
+
+
+class FakePorts:
+    # Port sets scan() returns, one per call; the last one stays
+    def __init__(self, *scans):
+        self.scans = list(scans)
+
+    def __call__(self):
+        ports = self.scans.pop(0) if len(self.scans) > 1 else self.scans[0]
+        return {info.device: info for info in ports}
+
+
+def watch(scans, timeout=5.0):
+    events = []
+    done = threading.Event()
+
+    def on_change(added, removed, ports):
+        events.append((sorted(p.device for p in added), sorted(p.device for p in removed)))
+        done.set()
+
+    watcher = PortWatcher(on_change, poll_interval=0.01, debounce=0.05, use_udev=False)
+    watcher.scan = FakePorts(*scans)
+    watcher.start()
+    done.wait(timeout)
+    # Give a second, unwanted event the chance to show up
+    done.clear()
+    done.wait(0.3)
+    watcher.stop()
+    return events
+
+
+def test_burst_is_reported_once():
+    a, b, c = port("/dev/ttyUSB0"), port("/dev/ttyUSB1"), port("/dev/ttyUSB2")
+    # A hub enumerating: the set keeps changing before it settles
+    events = watch([[a], [a], [a, b], [a, b, c], [a, b, c]])
+    assert events == [(["/dev/ttyUSB1", "/dev/ttyUSB2"], [])]
+
+
+def test_removal():
+    a, b = port("/dev/ttyUSB0"), port("/dev/ttyUSB1")
+    assert watch([[a, b], [a], [a]]) == [([], ["/dev/ttyUSB1"])]
+
+
+def test_change_that_reverts_is_not_reported():
+    a, b = port("/dev/ttyUSB0"), port("/dev/ttyUSB1")
+    assert watch([[a], [a, b], [a]], timeout=0.3) == []
+
+
+def test_is_mcu_port():
+    assert is_mcu_port(port("/dev/ttyUSB0", "CP2102 USB to UART Bridge Controller - CP210x"))
+    assert is_mcu_port(port("/dev/cu.wchusbserial1410"))
+    assert not is_mcu_port(port("/dev/ttyS0", "ttyS0"))
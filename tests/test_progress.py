@@ -0,0 +1,45 @@
+from progress import FlashProgress, ProgressThrottle, format_progress
+
+
+def test_progress():
+    progress = FlashProgress("/dev/ttyUSB0", 1000)
+    progress.started_at -= 2.0
+    progress.start_region("firmware.bin", 0x10000)
+    progress.advance(250, 100)
+    snapshot = progress.snapshot()
+    assert (snapshot["percent"], snapshot["written"], snapshot["sent"]) == (25, 250, 100)
+    assert snapshot["region"] == "firmware.bin" and snapshot["offset"] == 0x10000
+    assert 120 < snapshot["bytes_per_second"] <= 125
+    assert 5.9 < snapshot["eta"] < 6.1
+    progress.finish()
+    assert (progress.percent, progress.eta, progress.snapshot()["finished"]) == (100, 0.0, True)
+
+
+def test_nothing_to_write():
+    progress = FlashProgress("/dev/ttyUSB0", 0)
+    assert (progress.percent, progress.eta) == (0, None)
+    progress.finish()
+    assert progress.percent == 100
+
+
+def test_throttle_passes_first_and_final_update():
+    updates = []
+    throttle = ProgressThrottle(updates.append, interval=60)
+    progress = FlashProgress("/dev/ttyUSB0", 100)
+    for _ in range(10):
+        progress.advance(10, 5)
+        throttle(progress)
+    progress.finish()
+    throttle(progress)
+    assert [update["percent"] for update in updates] == [10, 100]
+
+
+def test_format_progress():
+    progress = FlashProgress("/dev/ttyUSB0", 1000)
+    progress.started_at -= 1.0
+    progress.start_region("firmware.bin", 0x10000)
+    progress.advance(512, 256)
+    assert format_progress(progress.snapshot()).startswith("51%  0.5 KiB/s  ETA ")
+    assert format_progress(progress.snapshot()).endswith("(firmware.bin)")
+    progress.finish()
+    assert "ETA" not in format_progress(progress.snapshot())
@@ -0,0 +1,85 @@
+import os
+
+from serial_log import (INDEX_INTERVAL, SerialLogStore, log_key, parse_line, read_index,
+                        seek_offset)
+
+MAC = "24:6F:28:12:34:56"
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+
+
+def test_log_key():
+    assert log_key(MAC) == "246f28123456"
+    assert log_key("socket://127.0.0.1:4000") == "socket_127.0.0.1_4000"
+
+
+def test_write_and_read(tmp_path):
+    store = SerialLogStore(str(tmp_path))
+    log = store.open(MAC)
+    log.write(["first", "second"], timestamp=1000.0)
+    log.write(["third"], timestamp=1001.0)
+    log.close()
+    assert store.devices() == ["246f28123456"]
+    assert [line for _, line in store.read(MAC)] == ["first", "second", "third"]
+    assert [line for _, line in store.read(MAC, since=1000.5)] == ["third"]
+    assert [line for _, line in store.read(MAC, until=1000.5)] == ["first", "second"]
+    assert list(store.search("^th", since=900.0)) == [("246f28123456", 1001.0, "third")]
+
+
+def test_index_seeks_close_to_the_time(tmp_path):
+    store = SerialLogStore(str(tmp_path))
+    log = store.open(MAC)
+    line = "x" * 100
+    for second in range(200):
+        log.write([line] * 10, timestamp=1000.0 + second)
+    log.close()
+    (path, _), = store.segments(MAC)
+    assert len(read_index(path)) > 10
+    # Byte position of the first line written at 1150
+    position = 0
+    with open(path, "rb") as f:
+        for raw in f:
+            if parse_line(raw.decode())[0] >= 1150.0:
+                break
+            position += len(raw)
+    offset = seek_offset(path, 1150.0)
+    assert position - INDEX_INTERVAL <= offset <= position
+    assert next(store.read(MAC, since=1150.0)) == (1150.0, line)
+
+
+def test_rotation_and_pruning(tmp_path):
+    store = SerialLogStore(str(tmp_path), max_bytes=4096, max_segments=3, compress=False)
+    for n in range(100):
+        log = store.open(MAC)
+        log.write([f"line {n:03d} " + "y" * 80], timestamp=1000.0 + n)
+        log.close()
+    segments = store.segments(MAC)
+    assert len(segments) == 3
+    lines = [line for _, line in store.read(MAC)]
+    assert lines[-1].startswith("line 099")
+    assert lines == sorted(lines)
+
+
+def test_sessions_append_to_the_segment(tmp_path):
+    store = SerialLogStore(str(tmp_path))
+    for n in range(3):
+        log = store.open(MAC)
+        log.write([f"session {n}"], timestamp=1000.0 + n)
+        log.close()
+    (path, _), = store.segments(MAC)
+    # One index entry per session
+    assert [offset > 0 for _, offset in read_index(path)] == [False, True, True]
+
+
+def test_idle_devices_hold_no_files(tmp_path):
+    store = SerialLogStore(str(tmp_path))
+    before = open_fds()
+    for n in range(50):
+        log = store.open(f"24:6f:28:00:00:{n:02x}")
+        log.write(["hello"])
+        log.close()
+    assert store._logs == {}
+    if before is not None:
+        assert open_fds() == before
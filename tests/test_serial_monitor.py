@@ -0,0 +1,54 @@
+import time
+
+import serial
+
+from serial_monitor import MAX_LINE_LENGTH, SerialMonitor
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_lines_are_assembled_across_reads():
+    monitor = SerialMonitor("loop://")
+    monitor._feed(b"ets Jun  8 2016\r\nrst:0x1 (POWER")
+    monitor._feed(b"ON_RESET)\r\n\r\nSetup ")
+    assert monitor.drain() == ["ets Jun  8 2016", "rst:0x1 (POWERON_RESET)", ""]
+    monitor._feed(b"done\n")
+    assert monitor.drain() == ["Setup done"]
+    assert monitor.drain() == []
+
+
+def test_overlong_line_is_passed_on_before_its_newline():
+    monitor = SerialMonitor("loop://")
+    monitor._feed(b"x" * (MAX_LINE_LENGTH + 10))
+    assert monitor.drain() == ["x" * (MAX_LINE_LENGTH + 10)]
+    monitor._feed(b"\n")
+    assert monitor.drain() == [""]
+
+
+def test_scrollback_and_backlog_are_capped():
+    monitor = SerialMonitor("loop://", max_lines=100)
+    monitor._feed(b"".join(b"line %d\n" % n for n in range(250)))
+    assert len(monitor.scrollback) == 100
+    assert monitor.scrollback[0] == "line 150"
+    # A consumer that fell behind only gets what the scrollback still holds
+    assert monitor.drain() == [f"line {n}" for n in range(150, 250)]
+    assert monitor.lines_received == 250
+
+
+def test_reads_a_port():
+    port = serial.serial_for_url("loop://", timeout=0.05)
+    port.write(b"hello\r\nprompt> ")
+    monitor = SerialMonitor("loop://", serial_port=port).start()
+    try:
+        # The unterminated prompt is passed on once the port goes quiet
+        assert wait_for(lambda: monitor.lines_received == 2)
+        assert monitor.drain() == ["hello", "prompt> "]
+        assert monitor.bytes_received == 15 and monitor.first_data_at is not None
+    finally:
+        monitor.stop()
+    assert not monitor.active and monitor.serial_port is None and monitor.error is None
@@ -0,0 +1,72 @@
+import io
+
+from telemetry import (COMPRESSION, WRITE, Telemetry, format_summary, load_jsonl, percentile,
+                       span)
+
+
+def test_percentile():
+    values = list(range(1, 21))
+    assert percentile(values, 0.5) == 10
+    assert percentile(values, 0.95) == 19
+    assert percentile([3.0], 0.95) == 3.0
+
+
+def record(telemetry, port, write, result="success"):
+    trace = telemetry.trace(port)
+    trace.add(WRITE, write)
+    telemetry.finish(trace, result)
+    return trace
+
+
+def test_summary():
+    telemetry = Telemetry()
+    for n in range(1, 11):
+        record(telemetry, f"/dev/ttyUSB{n % 2}", float(n))
+    assert telemetry.summary()[None][WRITE] == {"count": 10, "p50": 5.0, "p95": 10.0, "max": 10.0}
+    by_port = telemetry.summary(by_port=True)
+    assert by_port["/dev/ttyUSB1"][WRITE]["count"] == 5
+    assert "write" in format_summary(by_port)
+
+
+def test_spans():
+    telemetry = Telemetry()
+    trace = telemetry.trace("/dev/ttyUSB0")
+    with span(trace, WRITE, region="firmware.bin") as attrs:
+        attrs["bytes"] = 1024
+    with span(None, WRITE):
+        pass  # Not tracing
+    (recorded,) = trace.spans
+    assert (recorded["phase"], recorded["region"], recorded["bytes"]) == (WRITE, "firmware.bin", 1024)
+    assert set(trace.totals()) == {WRITE}
+
+
+def test_prometheus_counts_sessions_only():
+    telemetry = Telemetry()
+    package = telemetry.trace(None, stage="package")
+    package.add(COMPRESSION, 0.5)
+    telemetry.finish(package, "success")
+    record(telemetry, "/dev/ttyUSB0", 2.0)
+    record(telemetry, "/dev/ttyUSB1", 4.0, "failed")
+    text = telemetry.prometheus()
+    assert 'esp32flasher_phase_seconds_count{phase="write"} 2' in text
+    assert 'esp32flasher_phase_seconds{phase="write",quantile="0.95"} 4.000000' in text
+    assert 'esp32flasher_sessions_total{result="success"} 1' in text
+    assert 'esp32flasher_sessions_total{result="failed"} 1' in text
+
+
+def test_sink_and_cap(tmp_path):
+    path = tmp_path / "telemetry.jsonl"
+    with open(path, "w") as sink:
+        telemetry = Telemetry(sink, max_traces=3)
+        for n in range(10):
+            record(telemetry, "/dev/ttyUSB0", float(n))
+    assert len(telemetry.traces) == 3
+    # Everything still reaches the sink
+    loaded = load_jsonl([str(path)])
+    assert len(loaded.traces) == 10
+    assert loaded.summary()[None][WRITE]["max"] == 9.0
+    # Sink only, as the GUI keeps it
+    sink_only = Telemetry(io.StringIO(), max_traces=0)
+    record(sink_only, "/dev/ttyUSB0", 1.0)
+    assert len(sink_only.traces) == 0
+    assert sink_only.sink.getvalue().count("\n") == 1